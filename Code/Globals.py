@@ -52,6 +52,32 @@ HERO_FRICTION = 1.0
 
 ### LIGHT
 DEFAULT_LIGHT_ALPHA = 100
+LIGHT_MASK_CACHE_MEMORY = 32 * 1024 * 1024 # bytes of rendered masks all the lights together can keep
+LIGHT_MASK_CACHE_QUANTUM = 2 # pixels, precision of the dynamic obstructor positions in the mask cache
+LIGHT_BATCH_MIN_SEGMENTS = 24 # obstructor segments from which isRectInsideLight tests a rect with numpy, the scalar loop is faster below
+GRADIENT_LIGHTS = False # lights are drawn with a radial gradient
+LIGHT_BACKEND = 'polygons' # 'polygons' or 'raycast', how the lights compute their shadows
+LIGHT_RESOLUTION = 1 # divisor of the size lights draw their masks at (1, 2, 4...), or 'auto'
+LIGHT_AUTO_RESOLUTION_SIZE = 200 # radius from which 'auto' lights halve their resolution (again at every double)
+LIGHT_GRADIENT_CACHE_MEMORY = 16 * 1024 * 1024 # bytes of gradient surfaces shared by the lights
+LIGHT_INACTIVE_UPDATES = 1 # turned off lights whose mask is refreshed per frame, so it's ready when they turn on
+LIGHT_WORKERS = 0 # threads/processes computing the shadows of the lights updated in a frame, 0 for none
+LIGHT_WORKER_POOL = 'thread' # 'thread' (only overlaps the numpy work, the GIL serializes the rest) or 'process' (only takes lights with the 'polygons' backend)
+LIGHT_MASK_DEPTH = 8 # bits per pixel of the masks of lights without gradient: 8 (palettized) or 0 (same as the display)
+LIGHT_MASK_POOL_MEMORY = 8 * 1024 * 1024 # bytes of unused masks kept to be reused by any light
+LIGHT_LAYER_POOL_MEMORY = 16 * 1024 * 1024 # bytes of per pixel alpha layers (composited by LightMap) all the lights together can keep
+LIGHT_POLAR_BINS = 1024 # angular bins of the polar shadow maps of the lights (isPointLit, isRectLit)
+
+### QUALITY GOVERNOR (see QualityGovernor)
+QUALITY_GOVERNOR = True # lower the quality of expensive features while frames overrun 1000/FPS ms
+QUALITY_WINDOW = 30 # frames whose mean work time is compared with the budget
+QUALITY_DEGRADE_RATIO = 1.0 # mean over budget*ratio -> next feature is degraded
+QUALITY_RESTORE_RATIO = 0.6 # mean under budget*ratio -> last degraded feature is restored
+QUALITY_RESTORE_DELAY = 180 # frames since the last change before restoring anything
+QUALITY_LIGHT_RESOLUTION = 2 # the resolution divisor of the lights gets multiplied by it when degraded
+QUALITY_LIGHT_CULL_MARGIN = 64 # pixels a light must reach into the screen to be drawn when degraded
+QUALITY_LIGHT_CHANGES = 2 # lights switched to a new quality (or baked again into the lit field) per frame
+QUALITY_LOG = True # print the changes of quality level
 
 ### COLLISION TYPES
 HERO_C_TYPE = 1
@@ -0,0 +1,317 @@
+# -*- coding: UTF-8 -*-
+"""
+Headless microbenchmarks of the light engine.
+Builds synthetic fields of obstructors (from 100 to 10k rects, with different
+densities and light radiuses) and times the hot entry points of LightEngine,
+writing the results as JSON. Given a previous result file as baseline, it
+compares both and tells which entries got slower.
+
+Usage (from the Code folder):
+    python LightBenchmark.py --output results.json
+    python LightBenchmark.py --baseline results.json --output new.json
+    python LightBenchmark.py --quick
+"""
+import os
+# No window nor sound needed, must be set before pygame gets initiated
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+
+import sys
+import json
+import time
+import random
+import platform
+import argparse
+
+import pygame
+
+import LightEngine
+import LightGeometry
+from LightEngine import Light, radial_func, gradientAlphaFunction
+from Raycast import Raycast
+from ColorConstants import *
+
+COUNTS = (100, 1000, 10000) # obstructors in the field
+QUICK_COUNTS = (100, 1000)
+DENSITIES = (0.05, 0.2) # fraction of the field covered by obstructors
+RADIUSES = (100, 300) # light sizes
+MAX_OBSTRUCTOR_SIZE = 40 # pixels, obstructors are squares-ish up to this size
+QUERY_RECTS = 500 # rects asked to isRectInsideLight per measure
+WORKER_LIGHTS = 8 # lights updated together by the ShadowWorkers benchmark
+
+def makeField(count, density, seed = 0):
+    """
+    Returns a list of count pygame.Rect scattered (uniformly) over a square
+    field, sized so the rects cover the given fraction of it, and the side of
+    the field.
+    """
+    rng = random.Random(seed)
+    sizes = [(rng.randint(4, MAX_OBSTRUCTOR_SIZE), rng.randint(4, MAX_OBSTRUCTOR_SIZE))
+             for _ in range(count)]
+    area = sum(w*h for w, h in sizes)
+    side = int((area / density) ** 0.5)
+    rects = [pygame.Rect(rng.randint(0, side - w), rng.randint(0, side - h), w, h)
+             for w, h in sizes]
+    return rects, side
+
+def makeLight(rects, side, radius, backend = 'polygons', batch = True, auxiliar = False):
+    """
+    Returns a light placed in the middle of the field, bound to the rects its
+    rect reaches.
+    @auxiliar: whether the rects are bound as auxiliar obstructors, whose
+               shadows are computed on every update (the static ones are
+               drawn once, into the static layer).
+    """
+    light = Light(side//2, side//2, radius, backend = backend)
+    light.batch = batch
+    light.createMask()
+    reach = light.light_rect.inflate(2, 2)
+    light.setObstructors([r for r in rects if r.colliderect(reach)], auxiliar = auxiliar)
+    return light
+
+def measure(function, repeat, setup = None):
+    """
+    Calls function repeat times (calling setup, untimed, before each one) and
+    returns the min and median times in milliseconds.
+    """
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        function()
+        times.append((time.perf_counter() - start) * 1000)
+    times.sort()
+    return {'min_ms': times[0], 'median_ms': times[len(times)//2]}
+
+def benchUpdate(light, repeat):
+    """
+    Light.update drawing the mask every time (mask cache cleared, the static
+    layer is kept like in a game). Give it a light with auxiliar
+    obstructors (see makeLight) to time the shadow computation.
+    """
+    return measure(light.update, repeat, light.clearMaskCache)
+
+def benchIsRectInsideLight(light, repeat, seed = 0):
+    """
+    Light.isRectInsideLight over QUERY_RECTS rects spread over the light rect.
+    """
+    rng = random.Random(seed)
+    lr = light.light_rect
+    queries = [pygame.Rect(rng.randint(lr.left, lr.right), rng.randint(lr.top, lr.bottom), 20, 40)
+               for _ in range(QUERY_RECTS)]
+    x, y = lr.center
+    def run():
+        for rect in queries:
+            light.isRectInsideLight(rect, x, y)
+    return measure(run, repeat)
+
+def benchIsRectLit(light, repeat, seed = 0):
+    """
+    Light.isRectLit over the same rects as benchIsRectInsideLight, with the
+    polar shadow map already made.
+    """
+    rng = random.Random(seed)
+    lr = light.light_rect
+    queries = [pygame.Rect(rng.randint(lr.left, lr.right), rng.randint(lr.top, lr.bottom), 20, 40)
+               for _ in range(QUERY_RECTS)]
+    light.getPolarMap()
+    def run():
+        for rect in queries:
+            light.isRectLit(rect)
+    return measure(run, repeat)
+
+def benchPolarMap(light, repeat):
+    """
+    Making the polar shadow map of the light from scratch (static outline
+    already made).
+    """
+    light.getStaticOutline()
+    def setup():
+        light.polar_map = None
+    return measure(light.getPolarMap, repeat, setup)
+
+def benchGetPolygon(light, repeat):
+    """
+    LightGeometry.getPolygon over every obstructor of the light, already
+    clipped and moved to mask coordinates.
+    """
+    lr = light.light_rect
+    boxes = []
+    for r in light.obstructors:
+        if r.colliderect(lr):
+            nr = r.clip(lr).move(-lr.left, -lr.top)
+            boxes.append((nr.left, nr.top, nr.right, nr.bottom))
+    size = light.size
+    def run():
+        for l, t, r, b in boxes:
+            LightGeometry.getPolygon(size, size, size, l, t, r, b)
+    return measure(run, repeat)
+
+def benchSweep(light, repeat):
+    """
+    Raycast.sweep over the obstructors of the light, set up like the raycast
+    backend of Light does it (the setup isn't timed).
+    """
+    lr = light.light_rect
+    size = light.size
+    cropped = []
+    for r in light.obstructors:
+        if r.colliderect(lr):
+            nr = r.clip(lr).move(-lr.left, -lr.top)
+            if not nr.collidepoint(size, size):
+                cropped.append(nr)
+    holder = []
+    def setup():
+        raycast = Raycast()
+        raycast.addFacingRectList(cropped, size, size)
+        raycast.setBorderWithSize(size, size, size*2)
+        raycast.setLightLocation(size, size)
+        holder[:] = [raycast]
+    return measure(lambda: holder[0].sweep(), repeat, setup)
+
+def benchShadowWorkers(rects, side, radius, workers, repeat, lights = WORKER_LIGHTS):
+    """
+    ShadowWorkers.updateLights over a row of lights across the middle of the
+    field, every obstructor they reach being auxiliar (the shadows of the
+    static ones are in the static layer, the pool never sees them), with
+    their mask caches cleared.
+    @workers: size of the process pool, 0 computes everything in the
+              calling thread.
+    """
+    step = max(1, (side - 2*radius) // lights)
+    light_list = []
+    for i in range(lights):
+        light = Light(radius + i*step, side//2, radius)
+        light.createMask()
+        reach = light.light_rect.inflate(2, 2)
+        light.setObstructors([r for r in rects if r.colliderect(reach)], auxiliar = True)
+        light_list.append(light)
+    pool = LightEngine.ShadowWorkers(workers, 'process')
+    def setup():
+        for light in light_list:
+            light.clearMaskCache()
+    try:
+        pool.updateLights(light_list) # starts the workers
+        return measure(lambda: pool.updateLights(light_list), repeat, setup)
+    finally:
+        pool.shutdown()
+
+def benchRadialFunc(radius, repeat):
+    """
+    radial_func building a gradient from scratch (no GradientCache).
+    """
+    return measure(lambda: radial_func(radius, WHITE, (0,0,0), Afunc = gradientAlphaFunction),
+                   repeat)
+
+def runBenchmarks(counts = COUNTS, repeat = 5, log = True):
+    """
+    Runs every benchmark and returns the results, keyed by a name with their
+    parameters.
+    """
+    results = {}
+    def add(name, params, result):
+        result['params'] = params
+        results[name] = result
+        if log:
+            print('%-55s %9.3f ms' % (name, result['median_ms']))
+
+    for count in counts:
+        for density in DENSITIES:
+            rects, side = makeField(count, density)
+            for radius in RADIUSES:
+                params = {'count': count, 'density': density, 'radius': radius}
+                suffix = '[n=%d,d=%s,r=%d]' % (count, density, radius)
+                for backend, batch in (('polygons', True), ('polygons', False), ('raycast', True)):
+                    variant = backend if backend == 'raycast' else ('batch' if batch else 'scalar')
+                    dynamic = makeLight(rects, side, radius, backend, batch, auxiliar = True)
+                    add('Light.update.%s%s' % (variant, suffix),
+                        dict(params, obstructors = len(dynamic.auxiliar_obstructors)),
+                        benchUpdate(dynamic, repeat))
+                    light = makeLight(rects, side, radius, backend, batch)
+                    if backend == 'polygons':
+                        add('Light.isRectInsideLight.%s%s' % (variant, suffix), params,
+                            benchIsRectInsideLight(light, repeat))
+                add('Light.isRectLit%s' % suffix, params, benchIsRectLit(light, repeat))
+                add('Light.getPolarMap%s' % suffix, params, benchPolarMap(light, repeat))
+                add('getPolygon%s' % suffix, params, benchGetPolygon(light, repeat))
+                add('Raycast.sweep%s' % suffix, params, benchSweep(light, repeat))
+
+    rects, side = makeField(counts[-1], DENSITIES[-1])
+    workers = max(2, os.cpu_count() or 1)
+    for radius in RADIUSES:
+        params = {'count': counts[-1], 'density': DENSITIES[-1], 'radius': radius,
+                  'lights': WORKER_LIGHTS}
+        suffix = '[n=%d,d=%s,r=%d,lights=%d]' % (counts[-1], DENSITIES[-1], radius, WORKER_LIGHTS)
+        add('ShadowWorkers.updateLights.serial%s' % suffix, params,
+            benchShadowWorkers(rects, side, radius, 0, repeat))
+        add('ShadowWorkers.updateLights.process%s' % suffix, dict(params, workers = workers),
+            benchShadowWorkers(rects, side, radius, workers, repeat))
+
+    for radius in RADIUSES:
+        add('radial_func[r=%d]' % radius, {'radius': radius}, benchRadialFunc(radius, repeat))
+    return results
+
+def getMeta():
+    """
+    Describes where the results come from.
+    """
+    numpy = LightEngine.numpy
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'pygame': pygame.version.ver,
+        'numpy': numpy.__version__ if numpy is not None else None,
+        'cpus': os.cpu_count(),
+        'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+    }
+
+def compare(results, baseline, tolerance):
+    """
+    Prints the ratio between the min times (the least noisy) of the results
+    and the ones of the baseline, for the entries both have.
+    @tolerance: ratio from which an entry counts as slower.
+    @return: list with the names of the entries that got slower.
+    """
+    slower = []
+    print('')
+    print('%-55s %9s %9s %7s' % ('entry', 'baseline', 'now', 'ratio'))
+    for name in sorted(results):
+        if name not in baseline:
+            continue
+        before = baseline[name]['min_ms']
+        now = results[name]['min_ms']
+        ratio = now / before if before else float('inf')
+        mark = ''
+        if ratio > tolerance:
+            slower.append(name)
+            mark = ' SLOWER'
+        print('%-55s %9.3f %9.3f %6.2fx%s' % (name, before, now, ratio, mark))
+    return slower
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Light engine microbenchmarks.')
+    parser.add_argument('--output', help = 'JSON file to write the results to')
+    parser.add_argument('--baseline', help = 'JSON file of a previous run to compare with')
+    parser.add_argument('--repeat', type = int, default = 5, help = 'runs of every measure')
+    parser.add_argument('--tolerance', type = float, default = 1.10,
+                        help = 'ratio to the baseline from which an entry is reported slower')
+    parser.add_argument('--quick', action = 'store_true', help = 'skip the 10k obstructor fields')
+    args = parser.parse_args(argv)
+
+    counts = QUICK_COUNTS if args.quick else COUNTS
+    results = runBenchmarks(counts, args.repeat)
+    output = {'meta': getMeta(), 'results': results}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(output, f, indent = 2, sort_keys = True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        if compare(results, baseline, args.tolerance):
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
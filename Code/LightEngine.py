@@ -3,9 +3,20 @@ import pygame
 import pymunk
 import math
 import helper
+import collections
+import array
+import concurrent.futures
+import multiprocessing
+import LightGeometry
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 from pymunk.vec2d import Vec2d
 from pygame.constants import *
+from Raycast import Raycast
 from ColorConstants import *
 from Globals import *
 
@@ -26,9 +37,9 @@ def getProjectedPoint(light, point, radius = None, output = 'pygame', mode = Non
     """
     if mode != 1:
         if not isinstance(light, pymunk.vec2d.Vec2d):
-            light = toPymunk(light)
+            light = helper.toPymunk(light)
         if not isinstance(point, pymunk.vec2d.Vec2d):
-            point = toPymunk(point)
+            point = helper.toPymunk(point)
 
     light_to_point = point - light
     projected_point = point + light_to_point
@@ -41,7 +52,7 @@ def getProjectedPoint(light, point, radius = None, output = 'pygame', mode = Non
         # projected_point *= 1.0075
 
     if output == 'pygame':
-        return toPygame(projected_point)
+        return helper.toPygame(projected_point)
     else:
         return projected_point
 
@@ -63,17 +74,17 @@ def getProjectionVerticesForLine(light, a, b, radius = None, output = 'pygame',
     """
     if mode != 1:
         if not isinstance(light, pymunk.vec2d.Vec2d):
-            light = toPymunk(light)
+            light = helper.toPymunk(light)
         if not isinstance(a, pymunk.vec2d.Vec2d):
-            a = toPymunk(a)
+            a = helper.toPymunk(a)
         if not isinstance(b, pymunk.vec2d.Vec2d):
-            b = toPymunk(b)    
+            b = helper.toPymunk(b)    
 
     c = getProjectedPoint(light, a, radius, output='pymunk', mode=1)
     d = getProjectedPoint(light, b, radius, output='pymunk', mode=1)
 
     if output == 'pygame':
-        return toPygame(a), toPygame(b), toPygame(c), toPygame(d)
+        return helper.toPygame(a), helper.toPygame(b), helper.toPygame(c), helper.toPygame(d)
     else:
         return a, b, c, d
 
@@ -89,11 +100,11 @@ def doesEdgeCastShadow(light, a, b, mode = None):
     """
     if mode != 1:
         if not isinstance(light, pymunk.vec2d.Vec2d):
-            light = toPymunk(light)
+            light = helper.toPymunk(light)
         if not isinstance(a, pymunk.vec2d.Vec2d):
-            a = toPymunk(a)
+            a = helper.toPymunk(a)
         if not isinstance(b, pymunk.vec2d.Vec2d):
-            b = toPymunk(b)  
+            b = helper.toPymunk(b)  
 
     start_to_end = b - a
     normal = pymunk.vec2d.Vec2d(-1 * start_to_end.y, start_to_end.x)
@@ -108,50 +119,595 @@ def drawShadowFromVertices(surface, light, vertices, radius=None, color=BLACK, a
     """
     Draws the shadow from the given vertices depending on their position relative
     to the given light.
+    For many polygons at once, use a ShadowBatcher.
     @light: light position in a (x, y) tuple or a vec2d.
     @vertices: MUST be ordered clockwise, list/tuple of vertices.
     @color: color in which the shadow will be drawn.
     @alpha: the alpha (1..255) that will be applied to the shadow.
-    @mode:
-      - 1: don't check if the arguments given are vec2d's (much faster)
+    @mode: kept for compatibility, tuples and vec2d's are always accepted.
     """
-    vertices = list(vertices)
-    if mode != 1:
-        if not isinstance(light, pymunk.vec2d.Vec2d):
-            light = toPymunk(light)
-        for n in range(len(vertices)):
-            if not isinstance(vertices[n], pymunk.vec2d.Vec2d):
-                vertices[n] = toPymunk(vertices[n])
-
-    if not isinstance(color, pygame.Color):
-        r,g,b = color
-        color = pygame.Color(r,b,g)
-    else:
-        color = copy.copy(color)
-    color.a = alpha
-
-    transparent_surface = surface.convert_alpha() #without this we can't draw transparencies
-
-    vertices.append(vertices[0])
-    for n in range(len(vertices)-1):
-        first, last = vertices[n], vertices[n+1]
-        if doesEdgeCastShadow(light, first, last): #if shadow should be drawn
-            # we get the vertices to draw the shadow polygon
-            a,b,c,d = getProjectionVerticesForLine(light, first, last, radius=radius,
-                                                   output = 'pygame', mode = 1)
-            # we arrange the vertices clock wise order
-            vertices_to_draw = (a, c, d, b) # clock wise
-            pygame.draw.polygon(transparent_surface, color, vertices_to_draw)
-    surface.blit(transparent_surface, (0,0))
+    global _shadow_batcher
+    if _shadow_batcher is None or _shadow_batcher.layer.get_size() != surface.get_size():
+        _shadow_batcher = ShadowBatcher(*surface.get_size())
+    _shadow_batcher.clearOccluders()
+    _shadow_batcher.addOccluder(vertices)
+    _shadow_batcher.draw(surface, light, radius, color, alpha)
+
+def _toPygamePoint(point):
+    """
+    Vec2d's are taken as pymunk coordinates and tuples as pygame ones, like
+    the rest of the shadow engine does. Returns a pygame (x, y) tuple.
+    """
+    if isinstance(point, pymunk.vec2d.Vec2d):
+        return point.x, WIN_HEIGHT - point.y
+    return point[0], point[1]
+
+class ShadowBatcher:
+    """
+    Draws the hard shadows cast by many occluder polygons from one light.
+    Every edge is projected at once (with numpy, if available) and the
+    shadows are drawn into a single alpha layer, reused between calls, that
+    gets blitted once.
+    """
+    def __init__(self, width, height):
+        """
+        @width, height: size of the surfaces that will be drawn on.
+        """
+        self.layer = pygame.Surface((width, height), pygame.SRCALPHA)
+        self.layer.fill((0, 0, 0, 0))
+        self.dirty_rect = None # part of the layer drawn on the last call
+        self.occluders = [] # lists of (x, y) vertices, in pygame coordinates
+        self.edges = None # (first vertex, second vertex) of every edge
+
+    def addOccluder(self, vertices):
+        """
+        @vertices: MUST be ordered clockwise, list/tuple of (x, y) tuples
+                   (pygame coordinates) or vec2d's (pymunk coordinates).
+        """
+        self.occluders.append([_toPygamePoint(vertex) for vertex in vertices])
+        self.edges = None
+
+    def clearOccluders(self):
+        self.occluders = []
+        self.edges = None
+
+    def getEdges(self):
+        """
+        Returns the edges of all the occluders: an (n, 4) numpy array of
+        (ax, ay, bx, by) rows if numpy is available, a list of
+        ((ax, ay), (bx, by)) otherwise. Built once until the occluders change.
+        """
+        if self.edges is None:
+            edges = []
+            for vertices in self.occluders:
+                for n in range(len(vertices)):
+                    edges.append((vertices[n-1], vertices[n]))
+            if BATCH_AVAILABLE:
+                edges = numpy.array(edges, dtype = float).reshape(-1, 4)
+            self.edges = edges
+        return self.edges
+
+    def getShadowPolygons(self, light, radius = None):
+        """
+        Returns the (a, projected a, projected b, b) polygons, clockwise and
+        in pygame coordinates, of the edges casting a shadow.
+        @light: light position in a (x, y) tuple or a vec2d.
+        @radius: int, if specified, the shadows will go up to the radius.
+        """
+        light = _toPygamePoint(light)
+        edges = self.getEdges()
+        if not BATCH_AVAILABLE:
+            return self._getShadowPolygonsScalar(edges, light, radius)
+        if not len(edges):
+            return []
+
+        ax, ay, bx, by = edges.T
+        to_a_x = ax - light[0]
+        to_a_y = ay - light[1]
+        # doesEdgeCastShadow, with the y axis of pygame
+        casting = (by - ay)*to_a_x - (bx - ax)*to_a_y > 0
+        edges = edges[casting]
+        if not len(edges):
+            return []
+
+        # getProjectedPoint of both ends
+        points = edges.reshape(-1, 2)
+        to_point = points - light
+        if radius:
+            length = numpy.hypot(to_point[:, 0], to_point[:, 1])
+            scale = numpy.zeros_like(length)
+            nonzero = length != 0
+            scale[nonzero] = (radius - length[nonzero]) / length[nonzero]
+            to_point *= scale[:, None]
+        projected = (points + to_point).reshape(-1, 4)
+
+        # a, c, d, b (clock wise), truncated like helper.toPygame
+        polygons = numpy.empty((len(edges), 4, 2), dtype = int)
+        polygons[:, 0] = edges[:, 0:2]
+        polygons[:, 1] = projected[:, 0:2]
+        polygons[:, 2] = projected[:, 2:4]
+        polygons[:, 3] = edges[:, 2:4]
+        return polygons.tolist()
+
+    def _getShadowPolygonsScalar(self, edges, light, radius = None):
+        """
+        Fallback of getShadowPolygons, one edge at a time.
+        """
+        light = helper.toPymunk(light)
+        polygons = []
+        for first, last in edges:
+            first = helper.toPymunk(first)
+            last = helper.toPymunk(last)
+            if doesEdgeCastShadow(light, first, last, mode = 1):
+                a,b,c,d = getProjectionVerticesForLine(light, first, last, radius=radius,
+                                                       output = 'pygame', mode = 1)
+                polygons.append((a, c, d, b)) # clock wise
+        return polygons
+
+    def draw(self, surface, light, radius = None, color = BLACK, alpha = 136):
+        """
+        Draws the shadows on the given surface.
+        @light: light position in a (x, y) tuple or a vec2d.
+        @radius: int, if specified, the shadows will go up to the radius.
+        @color: color in which the shadows will be drawn.
+        @alpha: the alpha (1..255) that will be applied to the shadows.
+        """
+        color = pygame.Color(color)
+        color.a = alpha
+
+        # Only the part drawn the last time needs to be cleaned
+        if self.dirty_rect is not None:
+            self.layer.fill((0, 0, 0, 0), self.dirty_rect)
+        self.dirty_rect = None
+
+        for polygon in self.getShadowPolygons(light, radius):
+            drawn = pygame.draw.polygon(self.layer, color, polygon)
+            if self.dirty_rect is None:
+                self.dirty_rect = drawn
+            else:
+                self.dirty_rect.union_ip(drawn)
+
+        if self.dirty_rect is not None:
+            surface.blit(self.layer, self.dirty_rect, self.dirty_rect)
+
+_shadow_batcher = None # used by drawShadowFromVertices
 
 ############################################
 ############## LIGHT  ENGINE ###############
 ############################################
+# Whether the numpy batch path of Light can be used (numpy is optional).
+BATCH_AVAILABLE = numpy is not None
+
+class ObstructorBuffer:
+    """
+    Obstructor rects of a light stored as (x, y, width, height) rows of a
+    preallocated array: first the static ones, then the auxiliar (dynamic)
+    ones. The auxiliar region can be rewritten every frame without allocating
+    anything, or kept and changed row by row through handles. The array only
+    grows when it gets full.
+    With numpy, getArray gives the rows without copying them.
+    """
+    def __init__(self, capacity = 64):
+        """
+        @capacity: number of rects the buffer can hold before growing.
+        """
+        self.static_count = 0
+        self.auxiliar_count = 0
+        self.allocate(capacity)
+
+        # Auxiliar rows added through insertAuxiliar can be moved and removed
+        # later by handle. Rows are relative to the auxiliar region, so adding
+        # or clearing static rects doesn't invalidate them.
+        self.next_handle = 0
+        self.handle_rows = {} # handle -> auxiliar row
+        self.row_handles = [] # auxiliar row -> handle (None if it has none)
+
+    def allocate(self, capacity):
+        """
+        Replaces the storage by a bigger one, keeping the rows.
+        """
+        data = array.array('i', [0]) * (4*capacity)
+        used = 4*len(self)
+        if used:
+            data[:used] = self.data[:used]
+        self.data = data
+        self.capacity = capacity
+        self.view = None
+        if BATCH_AVAILABLE:
+            self.view = numpy.frombuffer(self.data, dtype = numpy.intc).reshape(capacity, 4)
+
+    def __len__(self):
+        return self.static_count + self.auxiliar_count
+
+    def writeRow(self, n, rect):
+        """
+        Stores the given rect at the given row.
+        """
+        data = self.data
+        i = 4*n
+        data[i] = rect[0]
+        data[i+1] = rect[1]
+        data[i+2] = rect[2]
+        data[i+3] = rect[3]
+
+    def addStatic(self, rect):
+        """
+        Adds a static rect, moving the auxiliar ones one row forward.
+        @rect: pygame.Rect or (x, y, width, height).
+        """
+        if len(self) == self.capacity:
+            self.allocate(self.capacity*2)
+        if self.auxiliar_count:
+            start = 4*self.static_count
+            end = 4*len(self)
+            self.data[start+4:end+4] = self.data[start:end]
+        self.writeRow(self.static_count, rect)
+        self.static_count += 1
+
+    def addAuxiliar(self, rect):
+        """
+        Adds an auxiliar rect.
+        @rect: pygame.Rect or (x, y, width, height).
+        """
+        if len(self) == self.capacity:
+            self.allocate(self.capacity*2)
+        self.writeRow(len(self), rect)
+        if self.auxiliar_count < len(self.row_handles):
+            self.row_handles[self.auxiliar_count] = None
+        else:
+            self.row_handles.append(None)
+        self.auxiliar_count += 1
+
+    def insertAuxiliar(self, rect):
+        """
+        Adds an auxiliar rect that can be moved or removed later.
+        @rect: pygame.Rect or (x, y, width, height).
+        @return: handle of the rect.
+        """
+        self.addAuxiliar(rect)
+        handle = self.next_handle
+        self.next_handle += 1
+        row = self.auxiliar_count - 1
+        self.handle_rows[handle] = row
+        self.row_handles[row] = handle
+        return handle
+
+    def moveAuxiliar(self, handle, rect):
+        """
+        Overwrites the rect of the given handle.
+        @rect: pygame.Rect or (x, y, width, height).
+        """
+        self.writeRow(self.static_count + self.handle_rows[handle], rect)
+
+    def removeAuxiliar(self, handle):
+        """
+        Removes the rect of the given handle, the last auxiliar row takes its
+        place.
+        """
+        row = self.handle_rows.pop(handle)
+        last = self.auxiliar_count - 1
+        if row != last:
+            data = self.data
+            i = 4*(self.static_count + row)
+            j = 4*(self.static_count + last)
+            data[i] = data[j]
+            data[i+1] = data[j+1]
+            data[i+2] = data[j+2]
+            data[i+3] = data[j+3]
+            moved = self.row_handles[last]
+            self.row_handles[row] = moved
+            if moved is not None:
+                self.handle_rows[moved] = row
+        self.auxiliar_count = last
+
+    def getAuxiliarRow(self, handle):
+        """
+        Returns the row of the given handle in the whole buffer.
+        """
+        return self.static_count + self.handle_rows[handle]
+
+    def clearStatic(self):
+        """
+        Removes the static rects, moving the auxiliar ones to the beginning.
+        """
+        if self.auxiliar_count and self.static_count:
+            start = 4*self.static_count
+            self.data[:4*self.auxiliar_count] = self.data[start:start + 4*self.auxiliar_count]
+        self.static_count = 0
+
+    def clearAuxiliar(self):
+        self.auxiliar_count = 0
+        self.handle_rows.clear()
+
+    def getRect(self, n):
+        """
+        Returns a new pygame.Rect with the rect at the given row.
+        """
+        i = 4*n
+        return pygame.Rect(self.data[i], self.data[i+1], self.data[i+2], self.data[i+3])
+
+    def getRects(self, start = 0, stop = None):
+        """
+        Returns a list of new pygame.Rect with the rects of the given rows.
+        """
+        if stop is None:
+            stop = len(self)
+        return [self.getRect(n) for n in range(start, stop)]
+
+    def getArray(self, start = 0, stop = None):
+        """
+        Returns the given rows as a (n, 4) numpy array sharing the memory of
+        the buffer (only valid until the buffer changes). Requires numpy.
+        """
+        if stop is None:
+            stop = len(self)
+        return self.view[start:stop]
+
+class PolarShadowMap:
+    """
+    Polar shadow map of a light, the 2D analogue of a shadow map: the circle
+    of the light split in angular bins, each holding the distance to the
+    nearest obstructor along it (see LightGeometry.getPolarDepths). Telling
+    if a point is lit is a bin lookup and a distance compare.
+    The static part is computed once, the auxiliar obstructors are added on
+    top when they change.
+    Precision is that of the bins: the depth of a bin is taken along its
+    middle, so points next to the edge of a shadow may fall on either side.
+    """
+    def __init__(self, size, center, static_segments, bins = LIGHT_POLAR_BINS,
+                 batch = BATCH_AVAILABLE):
+        """
+        @size: radius of the light.
+        @center: (x, y) of the light, same coordinates as the segments.
+        @static_segments: iterable of (x1, y1, x2, y2), see
+                          Light.getStaticOutline.
+        @bins: number of angular bins.
+        @batch: whether to use numpy (if available) to compute the depths.
+        """
+        self.size = size
+        self.center = center
+        self.bins = bins
+        self.batch = batch
+        cx, cy = center
+        segments = [(x1 - cx, y1 - cy, x2 - cx, y2 - cy) for x1, y1, x2, y2 in static_segments]
+        self.static_depths = LightGeometry.getPolarDepths(size, segments, bins, batch)
+        self.depths = self.static_depths
+        self.auxiliar_rows = None # rows the auxiliar depths were made from
+
+    def setAuxiliar(self, rows):
+        """
+        Replaces the auxiliar obstructors added to the static ones.
+        @rows: array.array('i') (or any flat sequence) of x, y, width, height.
+        """
+        self.auxiliar_rows = array.array('i', rows)
+        cx, cy = self.center
+        segments = []
+        it = iter(rows)
+        for x, y, w, h in zip(it, it, it, it):
+            if w <= 0 or h <= 0:
+                continue
+            # rects out of the radius can't stop anything lit
+            dx = max(x - cx, 0, cx - x - w)
+            dy = max(y - cy, 0, cy - y - h)
+            if dx*dx + dy*dy > self.size*self.size:
+                continue
+            x, y = x - cx, y - cy
+            segments.extend(((x, y, x + w, y), (x + w, y, x + w, y + h),
+                             (x + w, y + h, x, y + h), (x, y + h, x, y)))
+        if not segments:
+            self.depths = self.static_depths
+            return
+        auxiliar = LightGeometry.getPolarDepths(self.size, segments, self.bins, self.batch)
+        self.depths = [min(a, b) for a, b in zip(self.static_depths, auxiliar)]
+
+    def isPointLit(self, x, y):
+        """
+        Returns a boolean depending on whether the given point is inside the
+        radius and no obstructor stands between it and the light.
+        @x,y: same coordinates as the center.
+        """
+        dx = x - self.center[0]
+        dy = y - self.center[1]
+        distance = math.hypot(dx, dy)
+        if distance > self.size:
+            return False
+        return distance <= self.depths[LightGeometry.getPolarBin(dx, dy, self.bins)]
+
+    def isRectLit(self, rect):
+        """
+        Returns a boolean depending on whether any vertex of the given rect
+        is lit (see isPointLit), like Light.isRectInsideLight does.
+        @rect: pygame.Rect instance, same coordinates as the center.
+        """
+        for x, y in (rect.topleft, rect.topright, rect.bottomright, rect.bottomleft):
+            if self.isPointLit(x, y):
+                return True
+        return False
+
+class MaskPool:
+    """
+    Unused mask surfaces (evicted from the mask cache of a light, or thrown
+    away with it), kept to be handed to the next light needing one of the
+    same size and depth instead of allocating it again. Shared by every
+    light, so lights of the same size reuse each other's buffers.
+    """
+    def __init__(self, memory_limit):
+        """
+        @memory_limit: bytes of surfaces the pool can keep.
+        """
+        self.surfaces = {} # (size, depth) -> list of surfaces
+        self.memory_limit = memory_limit
+        self.memory = 0
+        self.hits = 0
+        self.misses = 0
+
+    def acquire(self, size, depth):
+        """
+        Returns an unused surface of the given size and depth (as given to
+        release), or None if there isn't any. Its contents, palette,
+        colorkey and alpha are whatever they were.
+        """
+        surfaces = self.surfaces.get((tuple(size), depth))
+        if not surfaces:
+            self.misses += 1
+            return None
+        self.hits += 1
+        surface = surfaces.pop()
+        self.memory -= surface.get_pitch() * surface.get_height()
+        return surface
+
+    def release(self, surface, depth):
+        """
+        Gives back a surface nobody uses anymore. Dropped if the pool is full.
+        @depth: depth the surface was asked for (see Light.newMaskSurface).
+        """
+        memory = surface.get_pitch() * surface.get_height()
+        if self.memory + memory > self.memory_limit:
+            return
+        self.surfaces.setdefault((surface.get_size(), depth), []).append(surface)
+        self.memory += memory
+
+    def clear(self):
+        self.surfaces.clear()
+        self.memory = 0
+
+MASK_POOL = MaskPool(LIGHT_MASK_POOL_MEMORY)
+
+class MaskCacheBudget:
+    """
+    Memory budget shared by the mask caches of every light, so the total
+    grows with the budget and not with the number of lights. Keeps the least
+    recently used order of all the cached masks: when a light stores a mask
+    and the total goes over the limit, the oldest masks (of any light) are
+    evicted through Light.evictMask.
+    """
+    def __init__(self, memory_limit):
+        """
+        @memory_limit: bytes of cached masks all the lights together can keep.
+        """
+        self.entries = collections.OrderedDict() # (light, key) -> bytes
+        self.memory_limit = memory_limit
+        self.memory = 0
+
+    def add(self, light, key, memory):
+        """
+        Accounts a mask just cached by light, evicting the least recently
+        used ones until the total fits in memory_limit.
+        """
+        self.entries[(light, key)] = memory
+        self.memory += memory
+        while self.memory > self.memory_limit and len(self.entries) > 1:
+            (evicted_light, evicted_key), evicted_memory = \
+                self.entries.popitem(last = False)
+            self.memory -= evicted_memory
+            evicted_light.evictMask(evicted_key)
+
+    def touch(self, light, key):
+        """Marks the mask as the most recently used."""
+        self.entries.move_to_end((light, key))
+
+    def remove(self, light, key):
+        """Forgets a mask the light evicted by itself."""
+        self.memory -= self.entries.pop((light, key), 0)
+
+    def clear(self):
+        """Forgets every light (their caches must be cleared too)."""
+        self.entries.clear()
+        self.memory = 0
+
+MASK_CACHE = MaskCacheBudget(LIGHT_MASK_CACHE_MEMORY)
+
+class LayerPool:
+    """
+    Per pixel alpha layers of the lights (see Light.getLayer), shared by
+    every light within one memory budget, so the total grows with the budget
+    and not with the number of lights. A light keeps its layer (and skips
+    drawing it while its mask doesn't change) until the budget is full, then
+    the least recently used layer is given to the light asking for one.
+    Full resolution lights can ask for part of their layer only, which costs
+    that part.
+    """
+    def __init__(self, memory_limit):
+        """
+        @memory_limit: bytes of layers all the lights together can keep.
+        """
+        self.layers = collections.OrderedDict() # light -> [layer, mask_version]
+        self.small_layers = {} # size of the mask -> scratch layer (see drawLayer)
+        self.memory_limit = memory_limit
+        self.memory = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, light, area = None):
+        """
+        Returns the layer of the given light, drawn from its current mask.
+        Valid until another light asks for one.
+        @area: pygame.Rect (light coordinates), if given only that part of
+               the layer needs to be drawn.
+        """
+        entry = self.layers.get(light)
+        if entry is not None and entry[0].get_size() == light.light_rect.size:
+            self.layers.move_to_end(light)
+            if entry[1] == light.mask_version:
+                self.hits += 1
+                return entry[0]
+        else:
+            if entry is not None:
+                self.remove(light)
+            entry = self.layers[light] = [self.newLayer(light.light_rect.size), None]
+        self.misses += 1
+        layer = entry[0]
+        if area is not None and light.resolution == 1:
+            light.drawLayer(light.mask, layer, area = area)
+            entry[1] = None # only partly drawn
+            return layer
+        small_layer = None
+        if light.resolution != 1:
+            small_size = light.mask.get_size()
+            small_layer = self.small_layers.get(small_size)
+            if small_layer is None:
+                small_layer = self.small_layers[small_size] = pygame.Surface(small_size, SRCALPHA)
+        light.drawLayer(light.mask, layer, small_layer)
+        entry[1] = light.mask_version
+        return layer
+
+    def newLayer(self, size):
+        """
+        Returns a layer of the given size, evicting the least recently used
+        ones until it fits in the budget (taking one of the same size if
+        there is). Always returns one, even if it doesn't fit.
+        """
+        memory = size[0] * size[1] * 4
+        while self.layers and self.memory + memory > self.memory_limit:
+            _, (layer, _) = self.layers.popitem(last = False)
+            if layer.get_size() == size:
+                return layer
+            self.memory -= layer.get_pitch() * layer.get_height()
+        layer = pygame.Surface(size, SRCALPHA)
+        self.memory += layer.get_pitch() * layer.get_height()
+        return layer
+
+    def remove(self, light):
+        """Forgets the layer of the light, if it has one."""
+        entry = self.layers.pop(light, None)
+        if entry is not None:
+            self.memory -= entry[0].get_pitch() * entry[0].get_height()
+
+    def clear(self):
+        self.layers.clear()
+        self.small_layers.clear()
+        self.memory = 0
+
+LAYER_POOL = LayerPool(LIGHT_LAYER_POOL_MEMORY)
+
 class Light:
     """
     Provides a way to simulate light interfering with rectangles (other shapes
     may be smartly modeled as rectangles just for the lightning sake).
-    Works in PYGAME COORDINATES, aka 0,0 is topleft of the screen.
+    Works in PYGAME COORDINATES, aka 0,0 is topleft of the level (world
+    coordinates): light_rect and obstructors never move with the camera, so
+    scrolling never makes the mask change. The camera is only applied when
+    blitting.
 
     Usage:
      - Create your light using the constructor: l = Light(x, y, size, alpha)
@@ -161,35 +717,106 @@ class Light:
      - Whenever light position changes -> l.setLightPosition(x, y)
      - Before blitting -> l.update()
             WARNING: may not need to update every frame! it's expensive!
-     - Whenever you want to blit l.blit(surface_to_blit)
+     - Whenever you want to blit l.blit(surface_to_blit, camera_x, camera_y)
+
+    Shadows can be computed by two backends:
+     - 'polygons': one shadow polygon per obstructor (see LightGeometry).
+     - 'raycast': the visibility polygon of the light, found with an angular
+       sweep over the obstructor segments (see Raycast). Obstructors hidden
+       behind others don't cost any drawing, so it's faster when there are
+       many small obstructors. Its result is also used by isRectInsideLight.
+       The static obstructors are swept once, with the static layer, and
+       every update only sweeps the auxiliar ones.
+
+    The mask can be drawn at a fraction of the size of the light (see
+    setResolution) and scaled up when it is blitted or composited, big lights
+    then cost a fraction of the fill rate. Geometry (isRectInsideLight) is
+    always computed at full resolution.
+
+    Masks of lights without gradient are 8 bit palettized surfaces (see
+    LIGHT_MASK_DEPTH), a quarter of the memory and fill rate of full depth
+    ones. Masks no longer used go to MASK_POOL, shared by every light. The
+    mask caches of all the lights share one memory budget (MASK_CACHE). The
+    per pixel alpha layers composited by LightMap are shared too, one per
+    size (LAYER_POOL).
+
+    The light circle and the shadows of the static obstructors (cast by
+    their outline, see getStaticOutline) are drawn once, into the static
+    layer (see getStaticLayer). Every update copies it
+    and only draws the shadows of the auxiliar obstructors on top, so it
+    costs the same however complex the level around the light is.
     """
-    def __init__(self, x, y, size = 100, alpha = None, color = WHITE, gradient = False):
+    BACKENDS = ('polygons', 'raycast')
+
+    def __init__(self, x, y, size = 100, alpha = None, color = WHITE, gradient = False,
+                 backend = LIGHT_BACKEND, resolution = LIGHT_RESOLUTION):
         """
         @x,y: light position (middle)
         @size: radius of the light
         @alpha: if given (1..255), light will be drawn with some transparency.
         @color: color of the light.
         @gradient: indicates whether light will be drawn with a gradient or not.
+        @backend: 'polygons' or 'raycast', how shadows are computed.
+        @resolution: divisor (1, 2, 4...) of the size the mask is drawn at, or
+                     'auto' to pick it from the size of the light.
         """
         self.x = x
         self.y = y
         self.size = size
+        self.resolution = Light.getResolutionDivisor(resolution, size)
 
-        self.obstructors = []
-        self.obstructor_segments = []
-
-        # Data structures used for tracting with dynamic objects for extra efficiency
-        self.auxiliar_obstructors = []
-        self.auxiliar_obstructor_segments = []
-
-        # Data structures that allow us to update the obstructors with the camera
-        self.clean_obstructors = [] 
-        self.mode = 'dirty'    # changed by updateObstructors to dirty
+        # Static obstructors and, after them, the auxiliar ones (dynamic
+        # objects, changed every frame)
+        self.obstructor_buffer = ObstructorBuffer()
 
         self.light_rect = None
         self.mask = None
+        self.mask_version = 0 # changes every time self.mask changes
+
+        # pygame.mask.Mask of the lit pixels of the mask, for collisions
+        self.bitmask = None
+        self.bitmask_version = None # mask_version the bitmask was made from
+
+        # Full size copies of a mask drawn at a lower resolution
+        self.scaled_mask = None
+        self.scaled_mask_version = None # mask_version the scaled mask was made from
         self.color = color
         self.gradient = gradient
+        # bits per pixel of the masks, gradients need every color
+        self.mask_depth = 0 if gradient else LIGHT_MASK_DEPTH
+
+        # Use the numpy batch paths (shadows, isRectInsideLight) if available
+        self.batch = BATCH_AVAILABLE
+        self.segment_array = None # numpy segments of the static obstructors, made on demand
+        # Outline of the static obstructors: their sides without the ones
+        # shared by tiles (see LightGeometry.getOutlineSegments), on demand
+        self.static_outline = None
+
+        # The mask without the auxiliar obstructors, drawn on demand (see
+        # getStaticLayer)
+        self.static_layer = None
+        self.static_bitmask = None # pygame.mask.Mask of it, see getStaticBitmask
+        self.polar_map = None # PolarShadowMap, made on demand (see getPolarMap)
+
+        if backend not in Light.BACKENDS:
+            raise ValueError('Invalid backend')
+        self.backend = backend
+        # Raycast instances (mask coordinates), only with the raycast
+        # backend: the sweep of the auxiliar obstructors of the last update
+        # and the one of the static obstructors, made with the static layer
+        self.visibility = None
+        self.static_visibility = None
+
+        # LRU cache of rendered masks, keyed by the auxiliar obstructors
+        # overlapping the light (see getMaskKey)
+        self.mask_cache = collections.OrderedDict()
+        self.mask_cache_limit = LIGHT_MASK_CACHE_MEMORY # bytes, besides MASK_CACHE
+        self.mask_cache_quantum = LIGHT_MASK_CACHE_QUANTUM # pixels
+        self.mask_cache_memory = 0 # bytes
+        self.mask_cache_hits = 0
+        self.mask_cache_misses = 0
+        self.mask_is_cached = False # whether self.mask belongs to the cache
+        self.visibility_cache = {} # same keys as mask_cache, raycast backend
 
         if alpha:
             if 1 <= alpha <= 255:
@@ -199,31 +826,32 @@ class Light:
         else:
             self.alpha = None
 
+    @property
+    def obstructors(self):
+        """New list of pygame.Rect with the static obstructors."""
+        return self.obstructor_buffer.getRects(0, self.obstructor_buffer.static_count)
+
+    @property
+    def auxiliar_obstructors(self):
+        """New list of pygame.Rect with the auxiliar obstructors."""
+        return self.obstructor_buffer.getRects(self.obstructor_buffer.static_count)
+
     def addObstructor(self, rect, auxiliar = False):
         """
         Adds a obstructor to the light engine.
         @rect: pygame.rect object.
         @auxiliar: bool, adds the rect to a different list if given.
         """
-        top_left = rect.topleft
-        top_right = rect.topright
-        bottom_right = rect.bottomright
-        bottom_left = rect.bottomleft
-
         if auxiliar:
-            self.auxiliar_obstructors.append(rect)        
-
-            self.auxiliar_obstructor_segments.append((top_left, top_right))
-            self.auxiliar_obstructor_segments.append((top_right, bottom_right))
-            self.auxiliar_obstructor_segments.append((bottom_right, bottom_left))
-            self.auxiliar_obstructor_segments.append((bottom_left, top_left))
+            self.obstructor_buffer.addAuxiliar(rect)
         else:
-            self.obstructors.append(rect)            
-
-            self.obstructor_segments.append((top_left, top_right))
-            self.obstructor_segments.append((top_right, bottom_right))
-            self.obstructor_segments.append((bottom_right, bottom_left))
-            self.obstructor_segments.append((bottom_left, top_left))
+            self.clearMaskCache()
+            self.segment_array = None
+            self.static_outline = None
+            self.static_layer = None
+            self.static_bitmask = None
+            self.polar_map = None
+            self.obstructor_buffer.addStatic(rect)
 
     def setObstructors(self, rects, auxiliar = False):
         """
@@ -233,100 +861,257 @@ class Light:
         @auxiliar: bool, adds the rect to a different list if given.
         """
         if auxiliar:
-            self.auxiliar_obstructors = []
-            self.auxiliar_obstructor_segments = []
+            self.obstructor_buffer.clearAuxiliar()
             for rect in rects:
-                self.addObstructor(rect, auxiliar=True)
+                self.obstructor_buffer.addAuxiliar(rect)
 
         else:
-            self.obstructors = []
-            self.obstructor_segments = []
+            rects = list(rects)
+            if not rects and not self.obstructor_buffer.static_count:
+                return # nothing changes, keep the mask cache
+            self.clearMaskCache()
+            self.segment_array = None
+            self.static_outline = None
+            self.static_layer = None
+            self.static_bitmask = None
+            self.polar_map = None
+            self.obstructor_buffer.clearStatic()
             for rect in rects:
-                self.addObstructor(rect, auxiliar=False)
+                self.obstructor_buffer.addStatic(rect)
 
     def cleanAuxiliar(self):
-        self.auxiliar_obstructors = []
-        self.auxiliar_obstructor_segments = []
+        self.obstructor_buffer.clearAuxiliar()
 
-    def tracePoint(self,x1,y1,x2,y2,l):
+    def insertObstructor(self, rect):
+        """
+        Adds an auxiliar obstructor that can be moved or removed later on its
+        own, without resetting the rest of them.
+        @rect: pygame.rect object.
+        @return: (handle, touched), touched tells if the obstructor reaches the
+        area of the light (if it doesn't, the mask is still valid).
         """
-        Only used from getPolygon
+        handle = self.obstructor_buffer.insertAuxiliar(rect)
+        return handle, self._touchesLight(rect[0], rect[1], rect[2], rect[3])
+
+    def moveObstructor(self, handle, rect):
+        """
+        Moves an obstructor added with insertObstructor.
+        @handle: given by insertObstructor.
+        @rect: pygame.rect object, the new place of the obstructor.
+        @return: bool, if the area of the light was touched before or after
+        moving it. False if it didn't move.
+        """
+        data = self.obstructor_buffer.data
+        i = 4*self.obstructor_buffer.getAuxiliarRow(handle)
+        x, y, w, h = data[i], data[i+1], data[i+2], data[i+3]
+        if x == rect[0] and y == rect[1] and w == rect[2] and h == rect[3]:
+            return False
+        touched = (self._touchesLight(x, y, w, h) or
+                   self._touchesLight(rect[0], rect[1], rect[2], rect[3]))
+        self.obstructor_buffer.moveAuxiliar(handle, rect)
+        return touched
+
+    def removeObstructor(self, handle):
         """
-        theta = math.atan2((y2-y1),(x2-x1));    
-        if theta<0:
-            d= (180*(theta+(math.pi*2))/math.pi)
+        Removes an obstructor added with insertObstructor.
+        @handle: given by insertObstructor.
+        @return: bool, if the obstructor was touching the area of the light.
+        """
+        data = self.obstructor_buffer.data
+        i = 4*self.obstructor_buffer.getAuxiliarRow(handle)
+        touched = self._touchesLight(data[i], data[i+1], data[i+2], data[i+3])
+        self.obstructor_buffer.removeAuxiliar(handle)
+        return touched
+
+    def _touchesLight(self, x, y, w, h):
+        """
+        Tells if the given rect reaches the circle lit by the light. Always True
+        while the light isn't placed (no mask yet).
+        """
+        if self.light_rect is None:
+            return True
+        if w <= 0 or h <= 0:
+            return False
+        cx, cy = self.light_rect.center
+        nearest_x = min(max(cx, x), x + w)
+        nearest_y = min(max(cy, y), y + h)
+        return (nearest_x - cx)**2 + (nearest_y - cy)**2 <= self.size*self.size
+
+    def getShadowPolygons(self, rects = None):
+        """
+        Returns the list of shadow polygons (mask coordinates) casted by the
+        given rects. With the polygons backend uses the numpy batch path when
+        available, otherwise the scalar one. Both give exactly the same
+        polygons.
+        @rects: iterable of pygame.Rect objects, same coordinates as light_rect.
+                If not given, the shadows missing from the static layer: the
+                ones of the auxiliar obstructors (the batch path reads them
+                straight from the buffer).
+        """
+        static_count = self.obstructor_buffer.static_count
+        if self.backend == 'polygons' and self.batch and BATCH_AVAILABLE:
+            if rects is None:
+                data = self.obstructor_buffer.getArray(static_count)
+            else:
+                data = numpy.array([tuple(r) for r in rects], dtype=numpy.intc).reshape(-1, 4)
+            return self._getShadowPolygonsBatch(data)
+        if rects is None:
+            rects = self.obstructor_buffer.getRects(static_count)
+        if self.backend == 'raycast':
+            return self._getShadowPolygonsRaycast(rects)
+        return self._getShadowPolygonsScalar(rects)
+
+    def _getShadowPolygonsScalar(self, rects):
+        """
+        Fallback of getShadowPolygons, goes over the rects one at a time.
+        """
+        return LightGeometry.getShadowPolygonsScalar(self.size, self.getBounds(), rects)
+
+    def _getShadowPolygonsBatch(self, data):
+        """
+        Numpy version of _getShadowPolygonsScalar.
+        @data: (n, 4) array with the x, y, width, height of the rects.
+        """
+        return LightGeometry.getShadowPolygonsBatch(self.size, self.getBounds(), data)
+
+    def getBounds(self):
+        """
+        Returns the (left, top, right, bottom) of the light rect.
+        """
+        return (self.light_rect.left, self.light_rect.top,
+                self.light_rect.right, self.light_rect.bottom)
+
+    def getGeometry(self):
+        """
+        Returns the arguments of LightGeometry.getShadowPolygons for the
+        current auxiliar obstructors (a copy of them), so the polygons backend
+        shadows can be computed elsewhere (see ShadowWorkers).
+        """
+        buffer = self.obstructor_buffer
+        rows = buffer.data[4*buffer.static_count:4*len(buffer)]
+        return self.size, self.getBounds(), rows, self.batch and BATCH_AVAILABLE
+
+    def _getShadowPolygonsRaycast(self, rects, outline = ()):
+        """
+        Raycast backend of getShadowPolygons. Sweeps around the light over the
+        cropped rects and returns the areas it can't see, storing the sweep in
+        self.visibility.
+        Rects containing the light are ignored, else it would be all shadow.
+        @outline: segments as given by getStaticOutline, swept too.
+        """
+        cropped = []
+        for r in rects:
+            if self.light_rect.colliderect(r):
+                nr = r.clip(self.light_rect)
+                nr.move_ip(-self.light_rect.left, -self.light_rect.top)
+                if nr.collidepoint(self.size, self.size):
+                    continue
+                # rects out of the radius can't shadow anything lit
+                dx = max(nr.left - self.size, 0, self.size - nr.right)
+                dy = max(nr.top - self.size, 0, self.size - nr.bottom)
+                if dx*dx + dy*dy < self.size*self.size:
+                    cropped.append(nr)
+        segments = []
+        side = self.size*2
+        left, top = self.light_rect.topleft
+        for x1, y1, x2, y2 in outline:
+            x1 -= left
+            x2 -= left
+            y1 -= top
+            y2 -= top
+            # crop to the light rect (segments are horizontal or vertical)
+            if y1 == y2:
+                if not 0 <= y1 <= side:
+                    continue
+                x1, x2 = min(max(x1, 0), side), min(max(x2, 0), side)
+            else:
+                if not 0 <= x1 <= side:
+                    continue
+                y1, y2 = min(max(y1, 0), side), min(max(y2, 0), side)
+            if x1 == x2 and y1 == y2:
+                continue
+            # segments out of the radius can't shadow anything lit
+            dx = max(min(x1, x2) - self.size, 0, self.size - max(x1, x2))
+            dy = max(min(y1, y2) - self.size, 0, self.size - max(y1, y2))
+            if dx*dx + dy*dy < self.size*self.size:
+                segments.append((x1, y1, x2, y2))
+        raycast = Raycast()
+        raycast.addFacingRectList(cropped, self.size, self.size)
+        raycast.addFacingSegmentList(segments, self.size, self.size)
+        raycast.setBorderWithSize(self.size, self.size, self.size*2)
+        raycast.setLightLocation(self.size, self.size)
+        raycast.sweep()
+        self.visibility = raycast
+        return raycast.getShadowPolygons(self.size+10)
+
+    def getMaskKey(self):
+        """
+        Returns the key of the current mask in the mask cache: the positions
+        (relative to the light and quantized by mask_cache_quantum) of the
+        auxiliar obstructors overlapping the light.
+        Static obstructors aren't part of the key, changing them clears the
+        cache.
+        """
+        q = self.mask_cache_quantum
+        left, top = self.light_rect.topleft
+        right, bottom = self.light_rect.bottomright
+        data = self.obstructor_buffer.data
+        key = []
+        for n in range(self.obstructor_buffer.static_count, len(self.obstructor_buffer)):
+            i = 4*n
+            x, y, w, h = data[i], data[i+1], data[i+2], data[i+3]
+            # colliderect
+            if w > 0 and h > 0 and x < right and x + w > left and y < bottom and y + h > top:
+                key.append(((x - left)//q, (y - top)//q, w, h))
+        key.sort()
+        return tuple(key)
+
+    def clearMaskCache(self):
+        """
+        Forgets every cached mask (giving them to MASK_POOL, but the current
+        one). Hit and miss counters are kept.
+        """
+        for key, mask in self.mask_cache.items():
+            MASK_CACHE.remove(self, key)
+            if mask is not self.mask:
+                MASK_POOL.release(mask, self.mask_depth)
+        self.mask_cache.clear()
+        self.visibility_cache.clear()
+        self.mask_cache_memory = 0
+        self.mask_is_cached = False
+
+    def evictMask(self, key):
+        """
+        Drops a cached mask, giving it to MASK_POOL unless it's the current
+        one. Called by MASK_CACHE when the shared budget is full.
+        """
+        evicted = self.mask_cache.pop(key)
+        self.visibility_cache.pop(key, None)
+        self.mask_cache_memory -= evicted.get_pitch() * evicted.get_height()
+        if evicted is self.mask:
+            self.mask_is_cached = False
         else:
-            d= (180*(theta)/math.pi)
-        dx = math.cos(math.radians(d))
-        dy = math.sin(math.radians(d))                
-    
-        return (x2+dx*l,y2+dy*l)
+            MASK_POOL.release(evicted, self.mask_depth)
 
-    def getPolygon(self,x,y,box):
+    def _storeMask(self, key):
         """
-        Only used from drawMask with arguments:
-            getPolygon(self.size,self.size,r)
-        where r is the new_rect that was first cropped and then reallocated.
+        Adds the current mask to the cache, evicting the least recently used
+        masks until it fits in mask_cache_limit and in the budget shared with
+        the other lights (MASK_CACHE).
         """
-    
-        r = box.right
-        l = box.left
-        t = box.top
-        b = box.bottom
-        L = self.size+10
-        
-        tracePoint = self.tracePoint
-            
-        box = pygame.Rect(l,t,box.width-1,box.height-1)
-        
-        lightPos = (self.size,self.size)
-               
-        if x >= l and x <= r:
-            if y >= b: # directly under
-                #print "UNDER"
-                tp1 = tracePoint(x,y,l,b,L)
-                tp2 = tracePoint(x,y,r,b,L)
-                return ((box.bottomleft,tp1,[lightPos[0]-L,lightPos[1]-L],[lightPos[0]+L,lightPos[1]-L],tp2,box.bottomright))
-            else:   # directly above             
-                #print "ABOVE"
-                tp1 = tracePoint(x,y,l,t,L)
-                tp2 = tracePoint(x,y,r,t,L)
-                return ((box.topleft,tp1,[lightPos[0]-L,lightPos[1]+L],[lightPos[0]+L,lightPos[1]+L],tp2,box.topright))
-        elif y >= t and y <= b:
-            if x <= l: # directly to the left
-                #print "LEFT"
-                tp1 = tracePoint(x,y,l,b,L)
-                tp2 = tracePoint(x,y,l,t,L)
-                return ((box.bottomleft,tp1,[lightPos[0]+L,lightPos[1]+L],[lightPos[0]+L,lightPos[1]-L],tp2,box.topleft))
-            else:   # directly to the right
-                #print "RIGHT"
-                tp1 = tracePoint(x,y,r,b,L)
-                tp2 = tracePoint(x,y,r,t,L)
-                return ((box.bottomright,tp1,[lightPos[0]-L,lightPos[1]+L],[lightPos[0]-L,lightPos[1]-L],tp2,box.topright))
-        if y <= t:
-            if x <= l: # upper left
-                #print "UPPER LEFT"
-                tp1 = tracePoint(x,y,r,t,L)
-                tp2 = tracePoint(x,y,l,b,L)
-                return ((box.topleft,box.topright,tp1,tp2,box.bottomleft))
-            else:     # upper right
-                #print "UPPER RIGHT"
-                tp1 = tracePoint(x,y,l,t,L)
-                tp2 = tracePoint(x,y,r,b,L)
-                return ((box.topright,box.topleft,tp1,tp2,box.bottomright))
-        elif y >= b:
-            if x <= l: # lower left
-                #print "LOWER LEFT"
-                tp1 = tracePoint(x,y,r,b,L)
-                tp2 = tracePoint(x,y,l,t,L)
-                return ((box.bottomleft,box.bottomright,tp1,tp2,box.topleft))
-            else:     # lower right
-                #print "LOWER RIGHT"
-                tp1 = tracePoint(x,y,l,b,L)
-                tp2 = tracePoint(x,y,r,t,L)
-                return ((box.bottomright,box.bottomleft,tp1,tp2,box.topright))
-                
-        return None      
+        mask_memory = self.mask.get_pitch() * self.mask.get_height()
+        if mask_memory > min(self.mask_cache_limit, MASK_CACHE.memory_limit):
+            return
+        while self.mask_cache_memory + mask_memory > self.mask_cache_limit:
+            evicted_key = next(iter(self.mask_cache))
+            MASK_CACHE.remove(self, evicted_key)
+            self.evictMask(evicted_key)
+        self.mask_cache[key] = self.mask
+        if self.backend == 'raycast':
+            self.visibility_cache[key] = self.visibility
+        self.mask_cache_memory += mask_memory
+        self.mask_is_cached = True
+        MASK_CACHE.add(self, key, mask_memory)
 
     def update(self):
         """
@@ -334,90 +1119,114 @@ class Light:
         The core of the engine, calculates the parts of the light which are
         obfuscated by the obstructors and doesn't light those.
         Stores the results in self.mask (which is a pygame.surface).
+        If the auxiliar obstructors are placed like in a previous update, the
+        mask is taken from the mask cache instead.
+        """
+        key = self.getMaskKey()
+        if not self.loadCachedMask(key):
+            self.renderMask(key, self.getShadowPolygons())
+
+    def loadCachedMask(self, key):
+        """
+        Takes the mask of the given key from the mask cache, if it's there.
+        @key: given by getMaskKey.
+        @return: bool, whether the mask was found.
         """
+        cached = self.mask_cache.get(key)
+        if cached is None:
+            return False
+        self.mask_cache.move_to_end(key)
+        MASK_CACHE.touch(self, key)
+        self.mask_cache_hits += 1
+        if cached is not self.mask:
+            self.mask_version += 1
+        self.mask = cached
+        self.mask_is_cached = True
+        self.visibility = self.visibility_cache.get(key)
+        return True
+
+    def renderMask(self, key, polygons):
+        """
+        Draws the mask with the given shadow polygons and stores it in the
+        mask cache. Second half of update, for polygons computed elsewhere
+        (see ShadowWorkers).
+        @key: given by getMaskKey.
+        @polygons: given by getShadowPolygons.
+        """
+        self.mask_cache_misses += 1
+        self.mask_version += 1
+
+        # Never draw over a mask the cache is holding
+        if self.mask_is_cached:
+            self.mask = self.newMaskSurface()
+            self.mask_is_cached = False
+
         img = self.mask
-        nrects = []
-        # Iterate over all the rects
-        # If one is colliding with light rect, it gets cropped and then moved,
-        # and added to nrects list
-        if self.mode == 'dirty':
-            obstructors_list = self.obstructors + self.auxiliar_obstructors
-        elif self.mode == 'clean':
-            obstructors_list = self.clean_obstructors + self.auxiliar_obstructors
-        else:
-            raise ValueError('Invalid mode')
+        img.blit(self.getStaticLayer(), (0,0))
+        self.drawShadows(img, polygons)
 
-        for r in obstructors_list:
-            if self.light_rect.colliderect(r):
-                nr = r.clip(self.light_rect) # Returns a new rectangle that is cropped to be completely inside the argument Rect.
-                # Normalize the rectangle(move it near to 0,0 for following comparisons)
-                # Imagine a new rectangle at top left of size light_size*light_size,
-                # which is the mask, the rectangles are moved there.
-                nr.top = nr.top - self.light_rect.top
-                nr.left = nr.left - self.light_rect.left
-                nrects.append(nr)
-        
-        img.fill(1) # black, which is set to transparent before
-        # draws the light circle
-        if self.gradient:
-            def f(x):
-                # return ((x*x))
-                return math.sqrt(x) - 0.1
-                # return math.exp(x)
-                # return -math.cos(x/1.2)
-                # return 0.49*math.cos(10*x)+0.5
-                # return math.exp(-x/10.)*math.sin(x)
-                # return math.ceil(x/10.)
-                # return math.exp(x-10)+math.exp(-x-10)
-                # return x**2-x**4
-                # return 10*x+10
-
-            def f2(x):
-                return x
-                return math.sqrt(x) - 0.1
-                # return math.exp(x)
-
-            start = (self.size, self.size)
-            end = (self.size*2, self.size)
-            start_color = self.color
-            end_color = (0,0,0)
-            mode = 1
-            g_func = f
-            r_func = f
-            b_func = f
-            a_func = f2
-            draw_circle(img, start, end, start_color, end_color, mode = mode, Afunc=a_func)
-                        # Rfunc = r_func, Gfunc = g_func, Bfunc = b_func, Afunc = a_func)
-        else:
-            pygame.draw.circle(img, self.color, (self.size,self.size), self.size,0)
-        
-        # iterates over all the rects (which were found colliding, were cropped and moved)
-        for r in nrects:
-            # if r.collidepoint(self.x, self.y):
-            #     img.fill(1)
-            #     return
-            p = self.getPolygon(self.size,self.size,r)                
-            if p:
-                pygame.draw.polygon(img, 1, p, 0)
-        
         # draws the center of the light - the light 'producer'
         # pygame.draw.circle(img, 3, (self.size,self.size), 2)
 
-    def updateObstructors(self, camera_x, camera_y):
+        self._storeMask(key)
+
+    def getStaticLayer(self):
         """
-        Updates position of the obstructors given a camera x and y.
-        @x,y: camera_x and camera_y.
+        Returns the mask as if there were no auxiliar obstructors: the light
+        circle and the shadows of the static obstructors. Drawn the first
+        time it's asked for and kept until the static obstructors change.
+        With the raycast backend, the sweep of the static obstructors is kept
+        too, in self.static_visibility.
+        Has no colorkey nor alpha, so it can be copied over the mask.
         """
-        self.mode = 'clean'
-        self.clean_obstructors = []
-        for obstructor in self.obstructors:
-            x, y = obstructor.topleft
-            clean_obstructor = obstructor.copy()
-            x -= camera_x
-            y += camera_y
-            clean_obstructor.topleft = (x, y)
-            self.clean_obstructors.append(clean_obstructor)
-    
+        if self.static_layer is None:
+            img = self.newMaskSurface()
+            img.set_colorkey(None)
+            img.set_alpha(None)
+            # the circle is at the resolution of the mask
+            radius = self.size
+            if self.resolution != 1:
+                radius = self.size * (1.0 / self.resolution)
+
+            img.fill(1) # black, which is set to transparent before
+            # draws the light circle
+            if self.gradient:
+                start = (radius, radius)
+                end = (radius*2, radius)
+                start_color = self.color
+                end_color = (0,0,0)
+                mode = 1
+                a_func = gradientAlphaFunction
+                draw_circle(img, start, end, start_color, end_color, mode = mode, Afunc=a_func,
+                            cache = GRADIENT_CACHE)
+            else:
+                pygame.draw.circle(img, self.color, (radius,radius), radius,0)
+
+            if self.backend == 'polygons':
+                # from the outline, so tiles cost as much as the merged rects
+                self.drawShadows(img, LightGeometry.getOutlineShadowPolygons(
+                    self.size, self.getBounds(), self.getStaticOutline()))
+            else:
+                # without replacing the sweep of the last update
+                visibility = self.visibility
+                self.drawShadows(img, self._getShadowPolygonsRaycast([], self.getStaticOutline()))
+                self.static_visibility = self.visibility
+                self.visibility = visibility
+            self.static_layer = img
+        return self.static_layer
+
+    def drawShadows(self, img, polygons):
+        """
+        Draws the given shadow polygons (full resolution mask coordinates) on
+        the given surface, at the resolution of the mask.
+        """
+        if self.resolution != 1:
+            scale = 1.0 / self.resolution
+            polygons = [[(px*scale, py*scale) for px, py in p] for p in polygons]
+        # draws the shadows of the rects (which were found colliding)
+        for p in polygons:
+            pygame.draw.polygon(img, 1, p, 0)
+
     def drawMap(self,surface, color = BLACK):
         """
         Helper method, draws all the obstructors on the given surface.
@@ -427,43 +1236,424 @@ class Light:
         for r in self.obstructors:
             pygame.draw.rect(surface, color, r, 0)
 
-    def createMask(self):
+    def newMaskSurface(self):
         """
         This method is highly customizable, serves the purpose of changing
         the aesthetic of the light.
+        Returns a new surface ready to be used as mask (taken from MASK_POOL
+        if it has one), its contents undefined.
+        """
+        side = int(math.ceil(self.size*2.0 / self.resolution))
+        mask = MASK_POOL.acquire((side, side), self.mask_depth)
+        if mask is None:
+            mask = self.newSurface((side, side))
+        else:
+            self.setSurfaceFormat(mask)
+        return mask
+
+    def newSurface(self, size):
+        """
+        Returns a surface of the given size with the depth and format of the
+        masks of the light.
         """
-        mask = pygame.Surface([self.size*2,self.size*2],HWSURFACE)#|HWPALETTE,8)        
-        # mask.set_palette([[0,0,0],[255,0,0],[180,180,180],[255,255,255]])
-        mask.set_colorkey(1, RLEACCEL) # 1 will be transparent
-        self.light_rect = mask.get_rect()
+        if self.mask_depth:
+            surface = pygame.Surface(size, HWSURFACE, self.mask_depth)
+        else:
+            surface = pygame.Surface(size, HWSURFACE)
+        self.setSurfaceFormat(surface)
+        return surface
+
+    def setSurfaceFormat(self, surface):
+        """
+        Gives the palette (8 bit surfaces), colorkey and alpha of the masks of
+        the light to the given surface.
+        """
+        if surface.get_bitsize() == 8:
+            # 0 black, 1 the colorkey (same pixel value as in full depth
+            # masks) and the rest the color of the light
+            surface.set_palette([(0,0,0), (0,0,1)] + [tuple(self.color[:3])]*254)
+        surface.set_colorkey(1, RLEACCEL) # 1 will be transparent
+        surface.set_alpha(self.alpha)
+
+    def createMask(self):
+        """
+        Creates the mask and the light rect of the light.
+        """
+        mask = self.newMaskSurface()
+        self.light_rect = pygame.Rect(0, 0, self.size*2, self.size*2)
         self.light_rect.center = (self.x, self.y)
-        if self.alpha:
-            mask.set_alpha(self.alpha)
+        self.clearMaskCache()
+        if self.mask is not None:
+            MASK_POOL.release(self.mask, self.mask_depth)
+        self.visibility = None
         self.mask = mask 
+        self.mask_version += 1
+        self.bitmask = None
+        self.scaled_mask = None
+        self.static_layer = None
+        self.static_bitmask = None
+
+    @staticmethod
+    def getResolutionDivisor(resolution, size):
+        """
+        Checks the given resolution divisor and returns it, replacing 'auto'
+        by the one for the given size: 1 below LIGHT_AUTO_RESOLUTION_SIZE,
+        doubled every time the size doubles, up to 4.
+        """
+        if resolution == 'auto':
+            resolution = 1
+            while resolution < 4 and size >= LIGHT_AUTO_RESOLUTION_SIZE*resolution:
+                resolution *= 2
+            return resolution
+        if resolution != int(resolution) or resolution < 1:
+            raise ValueError('Invalid resolution')
+        return int(resolution)
+
+    def setResolution(self, resolution, update = True):
+        """
+        Changes the resolution divisor of the mask, redrawing it (at the same
+        place) if it was already created.
+        @resolution: 1, 2, 4... or 'auto'.
+        @update: if False, the mask is made again but not drawn: it must be
+                 updated before it is used.
+        """
+        resolution = Light.getResolutionDivisor(resolution, self.size)
+        if resolution == self.resolution:
+            return
+        self.resolution = resolution
+        if self.mask is not None:
+            self.remakeMask(update)
+
+    def setGradient(self, gradient, update = True):
+        """
+        Turns the gradient of the light on or off, redrawing the mask (at the
+        same place) if it was already created.
+        @gradient: bool.
+        @update: same as in setResolution.
+        """
+        if gradient == self.gradient:
+            return
+        # the masks go back to the pool with the depth they were made with
+        self.clearMaskCache()
+        if self.mask is not None:
+            MASK_POOL.release(self.mask, self.mask_depth)
+        self.gradient = gradient
+        self.mask_depth = 0 if gradient else LIGHT_MASK_DEPTH
+        if self.mask is not None:
+            self.mask = None
+            self.remakeMask(update)
+
+    def remakeMask(self, update = True):
+        """
+        Creates the mask again, keeping the light where it was, and updates
+        it if asked to.
+        """
+        center = self.light_rect.center
+        self.createMask()
+        self.light_rect.center = center
+        if update:
+            self.update()
 
     def setLightPosition(self, x, y):
         """
         Warning: give coordinates in pygame's mode.
+        The static layer, the polar map and the cached masks are relative to
+        the light, they are thrown away if it moves (update to redraw it).
         """
         self.x = x
         self.y = y
+        if self.light_rect.center == (self.x, self.y):
+            return
         self.light_rect.center = (self.x, self.y)
+        self.clearMaskCache()
+        self.static_layer = None
+        self.static_bitmask = None
+        self.polar_map = None
 
-    def blit(self, surface):
+    def blit(self, surface, camera_x=0, camera_y=0):
         """
         Paints the current mask into the given surface.
+        @camera_x, camera_y: camera position, substracted from x and added to
+                             y (see CameraSystem).
+        """
+        surface.blit(self.getScaledMask(), (self.light_rect.left - camera_x,
+                                            self.light_rect.top + camera_y))
+
+    def getScaledMask(self):
+        """
+        Returns the mask at the size of light_rect: the mask itself at full
+        resolution, a copy scaled up (keeping the colorkey) otherwise. Only
+        remade when the mask changes.
         """
-        surface.blit(self.mask, self.light_rect.topleft)
+        if self.resolution == 1:
+            return self.mask
+        if self.scaled_mask_version != self.mask_version:
+            if self.scaled_mask is None:
+                self.scaled_mask = self.newSurface(self.light_rect.size)
+            # nearest neighbour, so the colorkey survives
+            pygame.transform.scale(self.mask, self.light_rect.size, self.scaled_mask)
+            self.scaled_mask_version = self.mask_version
+        return self.scaled_mask
+
+    def getLayer(self):
+        """
+        Returns the mask as a per pixel alpha surface: shadows transparent and
+        light with the alpha of the light, ready to be composited by LightMap.
+        A mask drawn at a lower resolution is scaled up smoothly, so the edges
+        of the shadows get soft instead of blocky.
+        The layer is shared with the lights of the same size (LAYER_POOL), it
+        must be used before another of them asks for it. Only redrawn when
+        the mask changes or the layer was used by another light.
+        """
+        return LAYER_POOL.get(self)
+
+    def drawLayer(self, mask, layer, small_layer = None, area = None):
+        """
+        Draws the given mask (see newMaskSurface) on the given per pixel alpha
+        surface, as getLayer does.
+        @layer: SRCALPHA surface of the size of light_rect.
+        @small_layer: SRCALPHA surface of the size of the mask, needed if the
+                      resolution isn't 1.
+        @area: pygame.Rect, only draws that part of the layer. Only at full
+               resolution.
+        """
+        target = layer if self.resolution == 1 else small_layer
+        if area is None:
+            area = target.get_rect()
+        target.fill((0,0,0,0), area)
+        # the colorkey leaves the shadows transparent, the rest gets
+        # copied opaque and then takes the alpha of the light
+        mask.set_alpha(None)
+        target.blit(mask, area, area)
+        if self.alpha:
+            mask.set_alpha(self.alpha)
+            target.fill((255,255,255,self.alpha), area, special_flags = BLEND_RGBA_MULT)
+        if target is not layer:
+            pygame.transform.smoothscale(target, self.light_rect.size, layer)
+
+    def getBitmask(self):
+        """
+        Returns a pygame.mask.Mask with the pixels the light draws (everything
+        but the shadows) set. Only remade when the mask changes.
+        """
+        if self.bitmask_version != self.mask_version:
+            if self.resolution == 1:
+                self.bitmask = pygame.mask.from_surface(self.mask) # uses the colorkey
+            else:
+                # what the light map draws: any pixel the light reaches
+                self.bitmask = pygame.mask.from_surface(self.getLayer(), 0)
+            self.bitmask_version = self.mask_version
+        return self.bitmask
+
+    def getStaticBitmask(self):
+        """
+        Returns a pygame.mask.Mask with the pixels the light draws when no
+        auxiliar obstructor is around: what getBitmask gives then. Made from
+        the static layer and kept until it changes.
+        """
+        if self.static_bitmask is None:
+            static_layer = self.getStaticLayer()
+            mask = self.newSurface(static_layer.get_size())
+            mask.blit(static_layer, (0,0))
+            if self.resolution == 1:
+                self.static_bitmask = pygame.mask.from_surface(mask) # uses the colorkey
+            else:
+                layer = pygame.Surface(self.light_rect.size, SRCALPHA)
+                self.drawLayer(mask, layer, pygame.Surface(mask.get_size(), SRCALPHA))
+                self.static_bitmask = pygame.mask.from_surface(layer, 0)
+        return self.static_bitmask
+
+    def isMaskInsideLight(self, mask, x, y):
+        """
+        Returns a boolean depending on whether any set pixel of the given mask
+        falls on a pixel drawn by the light, exactly as they are drawn. The
+        cost depends on the overlapping area only.
+        @mask: pygame.mask.Mask instance (e.g. from the sprite of the hero).
+        @x,y: position of the top left of the mask, same coordinates as
+              light_rect.
+        """
+        offset = (int(x) - self.light_rect.left, int(y) - self.light_rect.top)
+        return self.getBitmask().overlap(mask, offset) is not None
+
+    def getPolarMap(self):
+        """
+        Returns the polar shadow map of the light, made the first time it's
+        asked for and brought up to date when the obstructors (or the light)
+        moved since then: the static part is only made again if the static
+        obstructors changed or the light moved.
+        """
+        center = self.light_rect.center
+        if self.polar_map is None or self.polar_map.center != center:
+            self.polar_map = PolarShadowMap(self.size, center, self.getStaticOutline(),
+                                            batch = self.batch and BATCH_AVAILABLE)
+        buffer = self.obstructor_buffer
+        rows = buffer.data[4*buffer.static_count:4*len(buffer)]
+        if rows != self.polar_map.auxiliar_rows:
+            self.polar_map.setAuxiliar(rows)
+        return self.polar_map
+
+    def isPointLit(self, x, y):
+        """
+        Returns a boolean depending on whether the given point is lit, looked
+        up in the polar shadow map (see getPolarMap): far cheaper than
+        isRectInsideLight when many things are asked to the same light, at
+        the precision of its bins.
+        @x,y: same coordinates as light_rect.
+        """
+        return self.getPolarMap().isPointLit(x, y)
+
+    def isRectLit(self, rect):
+        """
+        Polar shadow map version of isRectInsideLight (see isPointLit).
+        @rect: pygame.Rect instance, same coordinates as light_rect.
+        """
+        return self.getPolarMap().isRectLit(rect)
 
     def isRectInsideLight(self, rect, x, y, camera_x=0, camera_y=0):
         """
-        Warning: Brute force approach! Assume low perfomance.
         Returns a boolean depending whether it is inside the casted light or
         not.
-        Tests every rect vertex against every segment formed by the obstructors.
+        Tests every rect vertex against every segment formed by the obstructors,
+        all at once with numpy if available (see areRectsInsideLight) and there
+        are at least LIGHT_BATCH_MIN_SEGMENTS segments; with less, the overhead
+        of numpy costs more than looping over them.
+        With the raycast backend, once updated, tests the vertices against the
+        visibility of the light instead.
         @rect: pygame.Rect instance.
-        @x,y: designed to be light x and y coordinates after applying camera
-              offsets.
+        @x,y: light x and y coordinates, same coordinates as the rect.
+        @camera_x, camera_y: only if the rect and x, y are screen coordinates
+                             (camera applied), to move the obstructors there.
+        """
+        if self.backend == 'raycast' and self.visibility is not None:
+            return self._isRectVisible(rect, x, y)
+        if self.batch and BATCH_AVAILABLE:
+            segments = len(self.getStaticOutline()) + 4*self.obstructor_buffer.auxiliar_count
+            if segments >= LIGHT_BATCH_MIN_SEGMENTS:
+                return self.areRectsInsideLight([rect], x, y, camera_x, camera_y)[0]
+        return self._isRectInsideLightScalar(rect, x, y, camera_x, camera_y)
+
+    def areRectsInsideLight(self, rects, x, y, camera_x=0, camera_y=0):
+        """
+        Batch version of isRectInsideLight, returns a list of booleans (one for
+        every given rect).
+        Every vertex of every rect is tested against all the segments at once,
+        after rejecting the segments out of the bounding box of the vertex to
+        light segments. Without numpy goes rect by rect.
+        @rects: list of pygame.Rect instances.
+        @x,y: light x and y coordinates, same coordinates as the rects.
+        """
+        if self.backend == 'raycast' and self.visibility is not None:
+            return [self._isRectVisible(rect, x, y) for rect in rects]
+        if not (self.batch and BATCH_AVAILABLE):
+            return [self._isRectInsideLightScalar(rect, x, y, camera_x, camera_y)
+                    for rect in rects]
+        if not rects:
+            return []
+
+        # vertices of every rect: top_left, top_right, bottom_right, bottom_left
+        corners = numpy.array([(r.left, r.top, r.right, r.bottom) for r in rects],
+                              dtype=numpy.float64)
+        vx = corners[:, [0, 2, 2, 0]]
+        vy = corners[:, [1, 1, 3, 3]]
+
+        # remove irrelevant vertices (far away)
+        lit = numpy.sqrt((vx-x)**2 + (vy-y)**2) <= self.size
+        if not lit.any():
+            return lit.any(axis=1).tolist()
+
+        segments = self.getSegmentArray(camera_x, camera_y)
+        ax = vx[lit][:, None]
+        ay = vy[lit][:, None]
+
+        # bounding box reject
+        min_x, max_x = min(ax.min(), x), max(ax.max(), x)
+        min_y, max_y = min(ay.min(), y), max(ay.max(), y)
+        cx, cy, dx, dy = segments[:, 0], segments[:, 1], segments[:, 2], segments[:, 3]
+        near = ((numpy.maximum(cx, dx) >= min_x) & (numpy.minimum(cx, dx) <= max_x) &
+                (numpy.maximum(cy, dy) >= min_y) & (numpy.minimum(cy, dy) <= max_y))
+        if near.any():
+            cx, cy, dx, dy = cx[near], cy[near], dx[near], dy[near]
+            # doSegmentsIntersect(A, B, C, D) for every vertex A and segment CD,
+            # B being the light
+            acd = (dy-ay)*(cx-ax) > (cy-ay)*(dx-ax)
+            bcd = (dy-y)*(cx-x) > (cy-y)*(dx-x)
+            abc = (cy-ay)*(x-ax) > (y-ay)*(cx-ax)
+            abd = (dy-ay)*(x-ax) > (y-ay)*(dx-ax)
+            blocked = ((acd != bcd) & (abc != abd)).any(axis=1)
+            lit[lit] = ~blocked
+
+        # if there is any relevant vertex left, the rect is affected by the
+        # light
+        return lit.any(axis=1).tolist()
+
+    def _isRectVisible(self, rect, x, y):
+        """
+        Raycast backend of isRectInsideLight: whether any vertex of the rect
+        is inside the radius and seen by both the sweep of the static
+        obstructors and the one of the last update.
+        """
+        self.getStaticLayer() # makes static_visibility
+        static_visibility = self.static_visibility
+        left = x - self.size
+        top = y - self.size
+        for vx, vy in (rect.topleft, rect.topright, rect.bottomright, rect.bottomleft):
+            if ((vx-x)**2 + (vy-y)**2 <= self.size**2 and
+                    static_visibility.isPointVisible(vx - left, vy - top) and
+                    self.visibility.isPointVisible(vx - left, vy - top)):
+                return True
+        return False
+
+    def getSegmentArray(self, camera_x=0, camera_y=0):
+        """
+        Returns the obstructor segments (the outline of the static ones and
+        the sides of the auxiliar ones) as a numpy array of rows
+        (x1, y1, x2, y2), adjusted to camera values if given.
+        """
+        buffer = self.obstructor_buffer
+        if self.segment_array is None:
+            self.segment_array = numpy.array(self.getStaticOutline(),
+                                             dtype=numpy.float64).reshape(-1, 4)
+        segments = self.segment_array
+        if buffer.auxiliar_count:
+            auxiliar = Light.getRectSegments(buffer.getArray(buffer.static_count))
+            segments = numpy.concatenate((segments, auxiliar))
+        if not (camera_x or camera_y):
+            return segments
+        return segments - (camera_x, -camera_y, camera_x, -camera_y)
+
+    def getStaticOutline(self):
+        """
+        Returns the outline of the static obstructors as (x1, y1, x2, y2)
+        segments: the sides shared by tiles placed side by side are left out,
+        they can't stop any light the rest doesn't. Made on demand, until the
+        static obstructors change.
+        """
+        if self.static_outline is None:
+            rects = self.obstructor_buffer.getRects(0, self.obstructor_buffer.static_count)
+            self.static_outline = LightGeometry.getOutlineSegments(rects)
+        return self.static_outline
+
+    @staticmethod
+    def getRectSegments(data):
+        """
+        Returns the 4 segments of every rect, as rows (x1, y1, x2, y2) of a
+        numpy array: top, right, bottom and left sides.
+        @data: (n, 4) array with the x, y, width, height of the rects.
+        """
+        x1 = data[:, 0].astype(numpy.float64)
+        y1 = data[:, 1].astype(numpy.float64)
+        x2 = x1 + data[:, 2]
+        y2 = y1 + data[:, 3]
+        segments = numpy.stack((x1, y1, x2, y1,
+                                x2, y1, x2, y2,
+                                x2, y2, x1, y2,
+                                x1, y2, x1, y1), axis=1)
+        return segments.reshape(-1, 4)
+
+    def _isRectInsideLightScalar(self, rect, x, y, camera_x=0, camera_y=0):
+        """
+        Warning: Brute force approach! Assume low perfomance.
+        Fallback of isRectInsideLight, one vertex and segment at a time.
         """
         top_left = rect.topleft
         top_right = rect.topright
@@ -474,18 +1664,15 @@ class Light:
 
         # adjust segments to camera values
         # print(camera_x, camera_y)
+        segments_aux = [((x1, y1), (x2, y2)) for x1, y1, x2, y2 in self.getStaticOutline()]
+        for r in self.obstructor_buffer.getRects(self.obstructor_buffer.static_count):
+            segments_aux.append((r.topleft, r.topright))
+            segments_aux.append((r.topright, r.bottomright))
+            segments_aux.append((r.bottomright, r.bottomleft))
+            segments_aux.append((r.bottomleft, r.topleft))
         if camera_x or camera_y:
-            segments_aux = []
-            for segment in self.obstructor_segments + self.auxiliar_obstructor_segments:
-                a = segment[0]
-                b = segment[1]
-                first_point = (a[0]-camera_x, a[1]+camera_y)
-                second_point = (b[0]-camera_x, b[1]+camera_y)
-                segments_aux.append((first_point, second_point))
-        else:
-            segments_aux = list(self.obstructor_segments)
-        # n = 1
-        # print(segments_aux[n], self.obstructor_segments[n])
+            segments_aux = [((a[0]-camera_x, a[1]+camera_y), (b[0]-camera_x, b[1]+camera_y))
+                            for a, b in segments_aux]
 
         # DEBUG
         # pygame.draw.circle(DISPLAYSURF, RED, rect.center, 5)
@@ -542,20 +1729,438 @@ class Light:
 
 
 
+class ShadowWorkers:
+    """
+    Updates several lights at once, computing their shadow polygons
+    concurrently, and drawing their masks in the calling thread as they come.
+    Two kinds of pools:
+     - 'thread': every backend, but only the numpy work (which releases
+       the GIL) runs concurrently, so the gain is small.
+     - 'process': only lights with the 'polygons' backend, through
+       LightGeometry (which doesn't import pygame nor Globals), so pure
+       python geometry uses more than one core. Other lights are computed
+       in the calling thread meanwhile. Workers are forked where possible,
+       spawned ones would import the main script again (and Globals with
+       it, opening a window); without fork a thread pool is used instead.
+    Lights found in their mask cache never reach the pool. Off by default
+    (LIGHT_WORKERS is 0): the static shadows are in the static layer, the
+    pool only gets the few auxiliar obstructors and the round trip costs
+    more than computing them (see the ShadowWorkers entries of
+    LightBenchmark).
+    """
+    POOLS = ('thread', 'process')
+
+    def __init__(self, workers = LIGHT_WORKERS, pool = LIGHT_WORKER_POOL):
+        """
+        @workers: size of the pool, with less than 1 everything is computed
+                  in the calling thread.
+        @pool: 'thread' or 'process'.
+        """
+        if pool not in ShadowWorkers.POOLS:
+            raise ValueError('Invalid pool')
+        self.workers = workers
+        self.pool = pool
+        self.executor = None # created on first use
+
+    def getExecutor(self):
+        if self.executor is None:
+            if self.pool == 'process' and 'fork' not in multiprocessing.get_all_start_methods():
+                self.pool = 'thread'
+            if self.pool == 'thread':
+                self.executor = concurrent.futures.ThreadPoolExecutor(max_workers = self.workers)
+            else:
+                self.executor = concurrent.futures.ProcessPoolExecutor(
+                    max_workers = self.workers, mp_context = multiprocessing.get_context('fork'))
+        return self.executor
+
+    def updateLights(self, lights):
+        """
+        Same as calling update on every given light.
+        @lights: list of Light objects, with their mask created.
+        """
+        pending = [] # (light, mask key) of the lights that need to be drawn
+        for light in lights:
+            key = light.getMaskKey()
+            if not light.loadCachedMask(key):
+                pending.append((light, key))
+
+        # not worth the round trip
+        if self.workers < 1 or len(pending) < 2:
+            for light, key in pending:
+                light.renderMask(key, light.getShadowPolygons())
+            return
+
+        executor = self.getExecutor()
+        jobs = []
+        for light, key in pending:
+            if self.pool == 'thread':
+                jobs.append(executor.submit(light.getShadowPolygons))
+            elif light.backend == 'polygons':
+                jobs.append(executor.submit(LightGeometry.getShadowPolygons,
+                                            *light.getGeometry()))
+            else:
+                jobs.append(None)
+        for (light, key), job in zip(pending, jobs):
+            if job is None:
+                polygons = light.getShadowPolygons()
+            else:
+                polygons = job.result()
+            light.renderMask(key, polygons)
+
+    def shutdown(self, wait = True):
+        """
+        Stops the pool, it's created again if needed.
+        @wait: whether to wait for the pending jobs to end.
+        """
+        if self.executor is not None:
+            self.executor.shutdown(wait)
+            self.executor = None
+
+    def __del__(self):
+        self.shutdown(False)
+
+class ObstructorGrid:
+    """
+    Uniform grid spatial index over rectangles, so the obstructors near a light
+    can be found without going through every obstructor of the level.
+    Works with whatever coordinates the rects are given in.
+
+    Usage:
+     - Create the grid: grid = ObstructorGrid(cell_size)
+     - Add the rects: handle = grid.insert(rect)
+     - Whenever a rect moves -> grid.move(handle, rect)
+     - Whenever a rect disappears -> grid.remove(handle)
+     - Get the rects colliding with another one: grid.query(rect)
+    """
+    def __init__(self, cell_size = 128):
+        """
+        @cell_size: side of every cell, in pixels.
+        """
+        self.cell_size = cell_size
+        self.cells = {} # (column, row) -> set of handles
+        self.rects = {} # handle -> copy of the indexed rect
+        self.items = {} # handle -> object returned by query
+        self.next_handle = 0
+
+    def getCells(self, rect):
+        """
+        Returns the list of (column, row) cells the given rect touches.
+        """
+        cs = self.cell_size
+        columns = range(rect.left//cs, (rect.right-1)//cs + 1)
+        rows = range(rect.top//cs, (rect.bottom-1)//cs + 1)
+        return [(column, row) for column in columns for row in rows]
+
+    def insert(self, rect, item = None):
+        """
+        Indexes the given rect and returns its handle.
+        @rect: pygame.Rect instance.
+        @item: returned by query instead of the rect if given.
+        """
+        handle = self.next_handle
+        self.next_handle += 1
+        self.rects[handle] = pygame.Rect(rect)
+        self.items[handle] = rect if item is None else item
+        for cell in self.getCells(rect):
+            self.cells.setdefault(cell, set()).add(handle)
+        return handle
+
+    def remove(self, handle):
+        """
+        Removes the rect with the given handle from the grid.
+        """
+        for cell in self.getCells(self.rects[handle]):
+            handles = self.cells[cell]
+            handles.discard(handle)
+            if not handles:
+                del self.cells[cell]
+        del self.rects[handle]
+        del self.items[handle]
+
+    def move(self, handle, rect):
+        """
+        Updates the position of the rect with the given handle.
+        @rect: pygame.Rect instance, new position of the rect.
+        """
+        old_rect = self.rects[handle]
+        if old_rect == rect:
+            return
+        old_cells = self.getCells(old_rect)
+        new_cells = self.getCells(rect)
+        if old_cells != new_cells:
+            for cell in old_cells:
+                handles = self.cells[cell]
+                handles.discard(handle)
+                if not handles:
+                    del self.cells[cell]
+            for cell in new_cells:
+                self.cells.setdefault(cell, set()).add(handle)
+        old_rect.topleft = rect.topleft
+        old_rect.size = rect.size
+
+    def query(self, rect):
+        """
+        Returns the items whose rect collides with the given one, in insertion
+        order. Only the cells touched by the given rect are visited.
+        @rect: pygame.Rect instance.
+        """
+        found = set()
+        cells = self.cells
+        for cell in self.getCells(rect):
+            handles = cells.get(cell)
+            if handles:
+                found.update(handles)
+        return [self.items[handle] for handle in sorted(found)
+                if self.rects[handle].colliderect(rect)]
+
+    def __len__(self):
+        return len(self.rects)
+
+
+
+class LightMap:
+    """
+    Screen sized buffer where all the visible lights are composited (max
+    blend), so the screen gets a single blit no matter how many lights there
+    are.
+    The buffer is kept between frames: camera movements scroll it, and only
+    the regions of the lights that changed, appeared, disappeared or got
+    uncovered by the scroll are composited again.
+
+    Usage:
+     - Create the map: light_map = LightMap(width, height)
+     - Every frame: light_map.update(lights, camera_x, camera_y), lights being
+       (key, Light) pairs of the lights that are on.
+     - Then: light_map.blit(surface)
+    """
+    def __init__(self, width, height):
+        """
+        @width, height: size of the screen.
+        """
+        self.surface = pygame.Surface((width, height), SRCALPHA)
+        self.surface.fill((0,0,0,0))
+        self.camera = None # camera of the last update
+        self.drawn = {} # key -> (mask_version, screen rect) of the last update
+
+    def update(self, lights, camera_x = 0, camera_y = 0):
+        """
+        Composites the given lights into the map.
+        @lights: iterable of (key, Light) tuples, the key must identify the
+                 light between updates.
+        @camera_x, camera_y: camera position (see CameraSystem).
+        """
+        screen = self.surface.get_rect()
+        camera = (int(camera_x), int(camera_y))
+        dirty = []
+
+        # Scroll what was drawn, only the uncovered strips need compositing
+        if self.camera != camera:
+            if self.camera is None:
+                dx = dy = screen.width
+            else:
+                dx = self.camera[0] - camera[0]
+                dy = camera[1] - self.camera[1]
+            if abs(dx) >= screen.width or abs(dy) >= screen.height:
+                self.drawn = {}
+                dirty.append(screen)
+            else:
+                self.surface.scroll(dx, dy)
+                if dx:
+                    left = screen.width + dx if dx < 0 else 0
+                    dirty.append(pygame.Rect(left, 0, abs(dx), screen.height))
+                if dy:
+                    top = screen.height + dy if dy < 0 else 0
+                    dirty.append(pygame.Rect(0, top, screen.width, abs(dy)))
+                for version, rect in self.drawn.values():
+                    rect.move_ip(dx, dy)
+            self.camera = camera
+
+        current = {}
+        for key, light in lights:
+            rect = light.light_rect.move(-camera[0], camera[1])
+            if not rect.colliderect(screen):
+                continue
+            current[key] = (light.mask_version, rect, light)
+            drawn = self.drawn.pop(key, None)
+            if drawn is None:
+                dirty.append(rect)
+            elif drawn[0] != light.mask_version or drawn[1] != rect:
+                dirty.append(rect)
+                dirty.append(drawn[1])
+        # lights that went off or out of the screen
+        for version, rect in self.drawn.values():
+            dirty.append(rect)
+
+        dirty = [region.clip(screen) for region in dirty]
+        dirty = [region for region in dirty if region]
+        for region in dirty:
+            self.surface.fill((0,0,0,0), region)
+        # light by light, their layers are shared (see LayerPool), drawing
+        # only the part needed
+        for version, rect, light in current.values():
+            areas = [region.clip(rect) for region in dirty]
+            areas = [area.move(-rect.left, -rect.top) for area in areas if area]
+            if not areas:
+                continue
+            layer = LAYER_POOL.get(light, areas[0].unionall(areas[1:]))
+            for area in areas:
+                self.surface.blit(layer, (rect.left + area.left, rect.top + area.top),
+                                  area, special_flags = BLEND_RGBA_MAX)
+
+        self.drawn = dict((key, (version, rect))
+                          for key, (version, rect, light) in current.items())
+
+    def blit(self, surface):
+        """
+        Paints the light map into the given surface.
+        """
+        surface.blit(self.surface, (0,0))
+
+    def toWorld(self, x, y):
+        """
+        Returns the world position of the given screen position, with the
+        same camera rounding used to draw the lights in the last update.
+        """
+        return x + self.camera[0], y - self.camera[1]
+
+
+
+class LitField:
+    """
+    World space bit field with every pixel lit by a set of lights with their
+    static obstructors only (see Light.getStaticBitmask). Meant to be baked
+    once, with the lights that never change (always on), so asking if
+    something is lit by any of them is a single mask lookup instead of one
+    per light.
+
+    Usage:
+     - Create the field: lit_field = LitField(lights), the lights with their
+       masks created.
+     - Then: lit_field.isMaskLit(mask, x, y)
+    It can also be baked a few lights at a time: LitField(lights, False)
+    and then addLight for each of them.
+    """
+    def __init__(self, lights = (), add = True):
+        """
+        @lights: iterable of Light, placed in the world. The field covers the
+                 union of their rects.
+        @add: whether to add the lights to the field (see addLight).
+        """
+        lights = list(lights)
+        if lights:
+            self.rect = lights[0].light_rect.unionall([l.light_rect for l in lights[1:]])
+        else:
+            self.rect = pygame.Rect(0, 0, 0, 0)
+        self.bitmask = pygame.mask.Mask(self.rect.size)
+        if add:
+            for light in lights:
+                self.addLight(light)
+
+    def addLight(self, light):
+        """
+        Sets the pixels the given light draws without auxiliar obstructors.
+        Parts out of the field are ignored.
+        @light: Light, placed in the world.
+        """
+        self.bitmask.draw(light.getStaticBitmask(), (light.light_rect.left - self.rect.left,
+                                               light.light_rect.top - self.rect.top))
+
+    def isMaskLit(self, mask, x, y):
+        """
+        Returns a boolean depending on whether any set pixel of the given mask
+        falls on a lit pixel of the field (see Light.isMaskInsideLight).
+        @mask: pygame.mask.Mask instance.
+        @x,y: world position of the top left of the mask.
+        """
+        offset = (int(x) - self.rect.left, int(y) - self.rect.top)
+        return self.bitmask.overlap(mask, offset) is not None
+
+
+
 ###### LIGHT GRADIENT #######
 
-def draw_circle(surface, startpoint, endpoint, startcolor, endcolor, Rfunc = (lambda x:x), Gfunc = (lambda x:x), Bfunc = (lambda x:x), Afunc = (lambda x:1), mode=0):
+# Easing functions used by gradient lights. They live at module level so the
+# gradient cache sees the same functions every time.
+def gradientColorFunction(x):
+    # return ((x*x))
+    return math.sqrt(x) - 0.1
+    # return math.exp(x)
+    # return -math.cos(x/1.2)
+    # return 0.49*math.cos(10*x)+0.5
+    # return math.exp(-x/10.)*math.sin(x)
+    # return math.ceil(x/10.)
+    # return math.exp(x-10)+math.exp(-x-10)
+    # return x**2-x**4
+    # return 10*x+10
+
+def gradientAlphaFunction(x):
+    return x
+    # return math.sqrt(x) - 0.1
+    # return math.exp(x)
+
+class GradientCache:
+    """
+    LRU cache of the surfaces made by radial_func, so every gradient is built
+    once and shared by every light (and frame) using it.
+    Keyed by radius, colors and easing functions (by identity, so use the same
+    function objects to get hits).
+    """
+    def __init__(self, memory_limit):
+        """
+        @memory_limit: bytes of surfaces the cache can keep.
+        """
+        self.gradients = collections.OrderedDict()
+        self.memory_limit = memory_limit
+        self.memory = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, radius, startcolor, endcolor, Rfunc, Gfunc, Bfunc, Afunc):
+        """
+        Same arguments as radial_func. Returns the gradient surface, which is
+        shared: it must not be drawn over.
+        """
+        key = (radius, tuple(startcolor), tuple(endcolor), Rfunc, Gfunc, Bfunc, Afunc)
+        gradient = self.gradients.get(key)
+        if gradient is not None:
+            self.gradients.move_to_end(key)
+            self.hits += 1
+            return gradient
+
+        self.misses += 1
+        gradient = radial_func(radius, startcolor, endcolor, Rfunc, Gfunc, Bfunc, Afunc)
+        gradient_memory = gradient.get_pitch() * gradient.get_height()
+        if gradient_memory <= self.memory_limit:
+            while self.memory + gradient_memory > self.memory_limit:
+                _, evicted = self.gradients.popitem(last = False)
+                self.memory -= evicted.get_pitch() * evicted.get_height()
+            self.gradients[key] = gradient
+            self.memory += gradient_memory
+        return gradient
+
+    def clear(self):
+        self.gradients.clear()
+        self.memory = 0
+
+GRADIENT_CACHE = GradientCache(LIGHT_GRADIENT_CACHE_MEMORY)
+
+def draw_circle(surface, startpoint, endpoint, startcolor, endcolor, Rfunc = (lambda x:x), Gfunc = (lambda x:x), Bfunc = (lambda x:x), Afunc = (lambda x:1), mode=0, cache=None):
     """
     Gradient.
     Instead of returning an Surface, this function draw it directy onto the 
     given Surface and returns the rect.
+    @cache: GradientCache instance, if given the gradient is taken from it.
     """
     dx = endpoint[0]-startpoint[0]
     dy = endpoint[1]-startpoint[1]
     radius = int(round(math.hypot(dx, dy)))
     pos = (startpoint[0]-radius, startpoint[1]-radius)
+    if cache is not None:
+        gradient = cache.get(radius, startcolor, endcolor, Rfunc, Gfunc, Bfunc, Afunc)
+    else:
+        gradient = radial_func(radius, startcolor, endcolor, Rfunc, Gfunc, Bfunc, Afunc)
     # if BLEND_MODES_AVAILABLE:
-    return surface.blit(radial_func(radius, startcolor, endcolor, Rfunc, Gfunc, Bfunc, Afunc), pos, None, mode)
+    return surface.blit(gradient, pos, None, mode)
     # else:
     #     return surface.blit(radial_func(radius, startcolor, endcolor, Rfunc, Gfunc, Bfunc, Afunc), pos)
 
@@ -563,6 +2168,17 @@ def radial_func(radius, startcolor, endcolor, Rfunc = (lambda x:x), Gfunc = (lam
     """
     Draws a linear raidal gradient on a square sized surface and returns
     that surface.
+    Uses radial_func_surfarray when numpy is available, radial_func_rings
+    otherwise.
+    """
+    if numpy is not None:
+        return radial_func_surfarray(radius, startcolor, endcolor, Rfunc, Gfunc, Bfunc, Afunc, colorkey)
+    return radial_func_rings(radius, startcolor, endcolor, Rfunc, Gfunc, Bfunc, Afunc, colorkey)
+
+def radial_func_rings(radius, startcolor, endcolor, Rfunc = (lambda x:x), Gfunc = (lambda x:x), Bfunc = (lambda x:x), Afunc = (lambda x:1), colorkey=(0,0,0,0)):
+    """
+    Same as radial_func, drawing one circle per radius unit (from the biggest
+    to the smallest).
     """
     bigSurf = pygame.Surface((2*radius, 2*radius)).convert_alpha()
     if len(colorkey)==3:
@@ -574,6 +2190,43 @@ def radial_func(radius, startcolor, endcolor, Rfunc = (lambda x:x), Gfunc = (lam
         draw_circle(bigSurf, color.eval(rad), (radius, radius), rad)
     return bigSurf
 
+def radial_func_surfarray(radius, startcolor, endcolor, Rfunc = (lambda x:x), Gfunc = (lambda x:x), Bfunc = (lambda x:x), Afunc = (lambda x:1), colorkey=(0,0,0,0)):
+    """
+    Same as radial_func, computed with numpy: every pixel takes the color of
+    the ring its distance to the center falls in, and the whole surface is
+    written at once through pygame.surfarray.
+    The rings are euclidean, so some pixels may be one ring away from the
+    ones pygame.draw.circle gives in radial_func_rings.
+    """
+    bigSurf = pygame.Surface((2*radius, 2*radius)).convert_alpha()
+    if len(colorkey)==3:
+        colorkey += (0,)
+    if radius <= 0:
+        return bigSurf
+    color = ColorInterpolator(radius, startcolor, endcolor, Rfunc, Gfunc, Bfunc, Afunc)
+    colors = color.evalArray(numpy.arange(radius+1)).tolist()
+
+    # mapped pixel value of every ring, ring 0 being the outside
+    map_rgb = bigSurf.map_rgb
+    ring_pixels = [map_rgb(colorkey)] + [map_rgb(c) for c in colors[1:]]
+    ring_pixels = numpy.array([p & 0xFFFFFFFF for p in ring_pixels], dtype=numpy.uint32)
+
+    # ring of every pixel, taking the distance from the pixel center.
+    # Computed for the bottom right quarter only, the others are mirrors.
+    offsets = numpy.arange(radius) + 0.5
+    distance = numpy.sqrt(offsets[:, None]**2 + offsets[None, :]**2)
+    ring = numpy.ceil(distance).astype(numpy.intp)
+    ring[ring > radius] = 0
+    quarter = ring_pixels[ring]
+
+    pixels = pygame.surfarray.pixels2d(bigSurf)
+    pixels[radius:, radius:] = quarter
+    pixels[:radius, radius:] = quarter[::-1, :]
+    pixels[radius:, :radius] = quarter[:, ::-1]
+    pixels[:radius, :radius] = quarter[::-1, ::-1]
+    del pixels # unlocks the surface
+    return bigSurf
+
 class ColorInterpolator(object):
     '''
     ColorInterpolator(distance, color1, color2, rfunc, gfunc, bfunc, afunc)
@@ -603,6 +2256,17 @@ class ColorInterpolator(object):
                 self.bInterpolator.eval(x), 
                 self.aInterpolator.eval(x)]
 
+    def evalArray(self, x):
+        '''
+        evalArray(x) -> numpy array of shape (len(x), 4)
+
+        eval for every position of the given numpy array.
+        '''
+        return numpy.stack((self.rInterpolator.evalArray(x),
+                            self.gInterpolator.evalArray(x),
+                            self.bInterpolator.evalArray(x),
+                            self.aInterpolator.evalArray(x)), axis = 1)
+
 class FunctionInterpolator(object):
     '''
     FunctionINterpolator(startvalue, endvalue, trange, func)
@@ -639,6 +2303,22 @@ class FunctionInterpolator(object):
         # make sure that the returned value is in [0,255]
         return int(min(max(self.a*self.func(self.b*(x+self.c))+self.d, 0), 255))
 
+    def evalArray(self, x):
+        '''
+        evalArray(x)->numpy array of ints
+
+        eval for every position of the given numpy array. func is applied to
+        the whole array when it supports it, else value by value.
+        '''
+        t = self.b*(x+self.c)
+        try:
+            y = numpy.asarray(self.func(t), dtype = numpy.float64)
+            if y.shape != t.shape:
+                y = numpy.broadcast_to(y, t.shape)
+        except TypeError: # func only accepts scalars (uses math, etc)
+            y = numpy.fromiter(map(self.func, t.tolist()), numpy.float64, len(t))
+        return numpy.clip(self.a*y+self.d, 0, 255).astype(numpy.intp)
+
 
 
 if __name__ == '__main__':
@@ -0,0 +1,524 @@
+# -*- coding: UTF-8 -*-
+"""
+Shadow geometry of the 'polygons' backend of LightEngine.Light, the
+outlines of the obstructors (see mergeRects and getOutlineSegments) and the
+polar shadow maps (see getPolarDepths).
+Only depends on math (and numpy, if available), neither on pygame nor on
+Globals, so it can also run in worker processes (see
+LightEngine.ShadowWorkers).
+
+Light rects are given as (left, top, right, bottom) bounds and obstructors
+as (x, y, width, height) rows, same coordinates as the bounds. The polygons
+returned are in mask coordinates (relative to the top left of the bounds).
+"""
+import math
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+if numpy is not None:
+    # Corners traced by getPolygon for every case (indexed by case number),
+    # corners being: 0 = (l,b), 1 = (r,b), 2 = (l,t), 3 = (r,t)
+    _FIRST_TRACED_CORNER = numpy.array([0, 2, 0, 1, 3, 2, 1, 0])
+    _SECOND_TRACED_CORNER = numpy.array([1, 3, 2, 3, 0, 1, 2, 3])
+
+def tracePoint(x1,y1,x2,y2,l):
+    """
+    Used by getPolygon and getOutlineShadowPolygons
+    """
+    theta = math.atan2((y2-y1),(x2-x1));
+    if theta<0:
+        d= (180*(theta+(math.pi*2))/math.pi)
+    else:
+        d= (180*(theta)/math.pi)
+    dx = math.cos(math.radians(d))
+    dy = math.sin(math.radians(d))
+
+    return (x2+dx*l,y2+dy*l)
+
+def getPolygon(x, y, size, l, t, r, b):
+    """
+    Returns the shadow polygon that the rect (l, t, r, b) casts from the
+    light at (x, y), or None. Used with x = y = size, where the rect was
+    first cropped and then moved to mask coordinates.
+    """
+    L = size+10
+
+    # corners of the rect, the right and bottom sides being inside it
+    top_left, top_right = (l, t), (r-1, t)
+    bottom_left, bottom_right = (l, b-1), (r-1, b-1)
+
+    lightPos = (size,size)
+
+    if x >= l and x <= r:
+        if y >= b: # directly under
+            tp1 = tracePoint(x,y,l,b,L)
+            tp2 = tracePoint(x,y,r,b,L)
+            return ((bottom_left,tp1,[lightPos[0]-L,lightPos[1]-L],[lightPos[0]+L,lightPos[1]-L],tp2,bottom_right))
+        else:   # directly above
+            tp1 = tracePoint(x,y,l,t,L)
+            tp2 = tracePoint(x,y,r,t,L)
+            return ((top_left,tp1,[lightPos[0]-L,lightPos[1]+L],[lightPos[0]+L,lightPos[1]+L],tp2,top_right))
+    elif y >= t and y <= b:
+        if x <= l: # directly to the left
+            tp1 = tracePoint(x,y,l,b,L)
+            tp2 = tracePoint(x,y,l,t,L)
+            return ((bottom_left,tp1,[lightPos[0]+L,lightPos[1]+L],[lightPos[0]+L,lightPos[1]-L],tp2,top_left))
+        else:   # directly to the right
+            tp1 = tracePoint(x,y,r,b,L)
+            tp2 = tracePoint(x,y,r,t,L)
+            return ((bottom_right,tp1,[lightPos[0]-L,lightPos[1]+L],[lightPos[0]-L,lightPos[1]-L],tp2,top_right))
+    if y <= t:
+        if x <= l: # upper left
+            tp1 = tracePoint(x,y,r,t,L)
+            tp2 = tracePoint(x,y,l,b,L)
+            return ((top_left,top_right,tp1,tp2,bottom_left))
+        else:     # upper right
+            tp1 = tracePoint(x,y,l,t,L)
+            tp2 = tracePoint(x,y,r,b,L)
+            return ((top_right,top_left,tp1,tp2,bottom_right))
+    elif y >= b:
+        if x <= l: # lower left
+            tp1 = tracePoint(x,y,r,b,L)
+            tp2 = tracePoint(x,y,l,t,L)
+            return ((bottom_left,bottom_right,tp1,tp2,top_left))
+        else:     # lower right
+            tp1 = tracePoint(x,y,l,b,L)
+            tp2 = tracePoint(x,y,r,t,L)
+            return ((bottom_right,bottom_left,tp1,tp2,top_right))
+
+    return None
+
+def getShadowPolygonsScalar(size, bounds, rects):
+    """
+    Returns the shadow polygons casted by the given rects, one at a time.
+    Every rect colliding with the bounds gets cropped and then moved, and
+    its polygon gets computed.
+    @size: radius of the light, centered in the bounds.
+    @bounds: (left, top, right, bottom) of the light rect.
+    @rects: iterable of (x, y, width, height), pygame.Rect objects work.
+    """
+    left, top, right, bottom = bounds
+    polygons = []
+    for x, y, width, height in rects:
+        # colliderect
+        if (width > 0 and height > 0 and x < right and x + width > left and
+                y < bottom and y + height > top):
+            # clip, then move to mask coordinates
+            p = getPolygon(size, size, size,
+                           max(x, left) - left, max(y, top) - top,
+                           min(x + width, right) - left, min(y + height, bottom) - top)
+            if p:
+                polygons.append(p)
+    return polygons
+
+def getShadowPolygonsBatch(size, bounds, data):
+    """
+    Numpy version of getShadowPolygonsScalar. Clips every rect against the
+    bounds at once, classifies the light position respective to all of them
+    and traces the two corners getPolygon needs for each one.
+    The trigonometry runs on the whole arrays with numpy, which may differ
+    from math (and so from tracePoint) in the last bit of the traced points.
+    @data: (n, 4) array with the x, y, width, height of the rects.
+    """
+    if not len(data):
+        return []
+    left, top, right, bottom = bounds
+    data = data.astype(numpy.int64)
+    x1 = data[:, 0]
+    y1 = data[:, 1]
+    x2 = x1 + data[:, 2]
+    y2 = y1 + data[:, 3]
+
+    # colliderect
+    hit = ((data[:, 2] > 0) & (data[:, 3] > 0) &
+           (x1 < right) & (x2 > left) & (y1 < bottom) & (y2 > top))
+    if not hit.any():
+        return []
+
+    # clip, then move to mask coordinates
+    l = numpy.maximum(x1[hit], left) - left
+    t = numpy.maximum(y1[hit], top) - top
+    r = numpy.minimum(x2[hit], right) - left
+    b = numpy.minimum(y2[hit], bottom) - top
+
+    x = y = size
+    L = size+10
+
+    # classify the position of the light respective to every rect,
+    # same order of checks as getPolygon
+    inside_x = (x >= l) & (x <= r)
+    inside_y = (y >= t) & (y <= b)
+    case = numpy.where(inside_x, numpy.where(y >= b, 0, 1),
+           numpy.where(inside_y, numpy.where(x <= l, 2, 3),
+           numpy.where(y <= t, numpy.where(x <= l, 4, 5),
+                               numpy.where(x <= l, 6, 7))))
+
+    # trace the two corners used by every case
+    traced = []
+    for corners in (_FIRST_TRACED_CORNER, _SECOND_TRACED_CORNER):
+        corner = corners[case]
+        px = numpy.where(corner % 2 == 0, l, r).astype(numpy.float64)
+        py = numpy.where(corner < 2, b, t).astype(numpy.float64)
+        theta = numpy.arctan2(py-y, px-x)
+        d = numpy.radians(numpy.where(theta < 0, 180*(theta+(math.pi*2))/math.pi,
+                                                 180*(theta)/math.pi))
+        dx = numpy.cos(d)
+        dy = numpy.sin(d)
+        traced.append(list(zip((px+dx*L).tolist(), (py+dy*L).tolist())))
+
+    up, down = [x-L, y-L], [x-L, y+L]
+    up_right, down_right = [x+L, y-L], [x+L, y+L]
+    polygons = []
+    for c, tp1, tp2, l_, t_, r_, b_ in zip(case.tolist(), traced[0], traced[1],
+                                           l.tolist(), t.tolist(),
+                                           (r-1).tolist(), (b-1).tolist()):
+        top_left, top_right = (l_, t_), (r_, t_)
+        bottom_left, bottom_right = (l_, b_), (r_, b_)
+        if c == 0: # directly under
+            p = (bottom_left, tp1, up, up_right, tp2, bottom_right)
+        elif c == 1: # directly above
+            p = (top_left, tp1, down, down_right, tp2, top_right)
+        elif c == 2: # directly to the left
+            p = (bottom_left, tp1, down_right, up_right, tp2, top_left)
+        elif c == 3: # directly to the right
+            p = (bottom_right, tp1, down, up, tp2, top_right)
+        elif c == 4: # upper left
+            p = (top_left, top_right, tp1, tp2, bottom_left)
+        elif c == 5: # upper right
+            p = (top_right, top_left, tp1, tp2, bottom_right)
+        elif c == 6: # lower left
+            p = (bottom_left, bottom_right, tp1, tp2, top_left)
+        else: # lower right
+            p = (bottom_right, bottom_left, tp1, tp2, top_right)
+        polygons.append(p)
+    return polygons
+
+def getShadowPolygons(size, bounds, rows, batch = True):
+    """
+    Entry point for the workers: returns the shadow polygons casted by the
+    rects of the given flat rows, with numpy if asked and available.
+    @rows: array.array('i') (or any flat sequence) of x, y, width, height.
+    """
+    if not len(rows):
+        return []
+    if batch and numpy is not None:
+        data = numpy.array(rows, dtype = numpy.int64).reshape(-1, 4)
+        return getShadowPolygonsBatch(size, bounds, data)
+    it = iter(rows)
+    return getShadowPolygonsScalar(size, bounds, zip(it, it, it, it))
+
+def mergeRects(rects):
+    """
+    Joins the rects tiled side by side into bigger ones covering exactly the
+    same area: first along rows (same top and height, touching or
+    overlapping), then along columns (same left and width). Repeated rects
+    are dropped.
+    @rects: iterable of (x, y, width, height), pygame.Rect objects work.
+    @return: list of (x, y, width, height) tuples.
+    """
+    rows = [] # [top, height, left, right]
+    for top, height, left, width in sorted(set((r[1], r[3], r[0], r[2]) for r in rects)):
+        last = rows[-1] if rows else None
+        if last and last[0] == top and last[1] == height and left <= last[3]:
+            last[3] = max(last[3], left + width)
+        else:
+            rows.append([top, height, left, left + width])
+
+    columns = [] # [left, width, top, bottom]
+    for left, width, top, bottom in sorted((l, r - l, t, t + h) for t, h, l, r in rows):
+        last = columns[-1] if columns else None
+        if last and last[0] == left and last[1] == width and top <= last[3]:
+            last[3] = max(last[3], bottom)
+        else:
+            columns.append([left, width, top, bottom])
+    return [(left, top, width, bottom - top) for left, width, top, bottom in columns]
+
+def _subtractIntervals(begin, end, intervals):
+    """
+    Returns the parts of [begin, end) not covered by the given intervals.
+    """
+    pieces = []
+    for start, stop in sorted(intervals):
+        if start > begin:
+            pieces.append((begin, min(start, end)))
+        begin = max(begin, stop)
+        if begin >= end:
+            return pieces
+    pieces.append((begin, end))
+    return pieces
+
+def _joinIntervals(intervals):
+    """
+    Returns the union of the given intervals, joining the ones that touch.
+    """
+    joined = []
+    for start, stop in sorted(intervals):
+        if joined and start <= joined[-1][1]:
+            if stop > joined[-1][1]:
+                joined[-1] = (joined[-1][0], stop)
+        else:
+            joined.append((start, stop))
+    return joined
+
+def getOutlineSegments(rects, cell_size = 64):
+    """
+    Returns the outline of the area covered by the given rects: the parts of
+    their sides with a rect on one side only, joined when they are on the
+    same line and touch. Interior sides (shared by rects tiled side by side,
+    or inside other rects) are left out.
+    Segments are (x1, y1, x2, y2) tuples going clockwise around the area
+    (y axis pointing down), so a point (px, py) is outside of a segment when
+    (x2-x1)*(py-y1) - (y2-y1)*(px-x1) < 0.
+    @rects: iterable of (x, y, width, height), pygame.Rect objects work.
+    @cell_size: of the spatial hash used to find the neighbours of a rect.
+    """
+    rects = [tuple(r) for r in rects if r[2] > 0 and r[3] > 0]
+    cells = {}
+    for n, (x, y, w, h) in enumerate(rects):
+        for cx in range(x // cell_size, (x + w - 1) // cell_size + 1):
+            for cy in range(y // cell_size, (y + h - 1) // cell_size + 1):
+                cells.setdefault((cx, cy), []).append(n)
+
+    def occupied(left, top, right, bottom, vertical):
+        """
+        Intervals (along the strip) covered by the rects overlapping the
+        strip [left, right) x [top, bottom).
+        """
+        found = set()
+        for cx in range(left // cell_size, (right - 1) // cell_size + 1):
+            for cy in range(top // cell_size, (bottom - 1) // cell_size + 1):
+                found.update(cells.get((cx, cy), ()))
+        intervals = []
+        for n in found:
+            x, y, w, h = rects[n]
+            if x < right and x + w > left and y < bottom and y + h > top:
+                if vertical:
+                    intervals.append((max(y, top), min(y + h, bottom)))
+                else:
+                    intervals.append((max(x, left), min(x + w, right)))
+        return intervals
+
+    tops, bottoms, lefts, rights = {}, {}, {}, {}
+    for x, y, w, h in rects:
+        r, b = x + w, y + h
+        # a side is outline where the strip of pixels just out of it is free
+        tops.setdefault(y, []).extend(_subtractIntervals(x, r, occupied(x, y - 1, r, y, False)))
+        bottoms.setdefault(b, []).extend(_subtractIntervals(x, r, occupied(x, b, r, b + 1, False)))
+        lefts.setdefault(x, []).extend(_subtractIntervals(y, b, occupied(x - 1, y, x, b, True)))
+        rights.setdefault(r, []).extend(_subtractIntervals(y, b, occupied(r, y, r + 1, b, True)))
+
+    segments = []
+    for y in sorted(tops):
+        segments.extend((start, y, stop, y) for start, stop in _joinIntervals(tops[y]))
+    for x in sorted(rights):
+        segments.extend((x, start, x, stop) for start, stop in _joinIntervals(rights[x]))
+    for y in sorted(bottoms):
+        segments.extend((stop, y, start, y) for start, stop in _joinIntervals(bottoms[y]))
+    for x in sorted(lefts):
+        segments.extend((x, stop, x, start) for start, stop in _joinIntervals(lefts[x]))
+    return segments
+
+def getOutlineShadowPolygons(size, bounds, segments):
+    """
+    Returns the shadow polygons casted by the outline segments (see
+    getOutlineSegments) facing the light, one per segment (plus a triangle
+    per inner corner): from the segment up to out of the light rect. Their
+    edges are the ones of getPolygon, so together they shadow the same
+    pixels as the polygons it gives for the rects of the outline, the area
+    itself included (its right and bottom sides being inside it), but
+    interior sides cost nothing. Pixels only differ where getPolygon leaves
+    some lit (a seam between two rects seen almost edge on, the far side of
+    a wide shadow cutting into a big light) and when the light is on a side
+    (the outline then shadows the whole half plane behind it).
+    @size: radius of the light, centered in the bounds.
+    @bounds: (left, top, right, bottom) of the light rect.
+    @segments: iterable of (x1, y1, x2, y2), same coordinates as the bounds.
+    """
+    left, top, right, bottom = bounds
+    x = y = size
+    L = size+10
+    step = math.pi/4 # keeps the far side of the polygons out of the light rect
+    far = (size*math.sqrt(2) + 1) / math.cos(step/2)
+    segments = list(segments)
+    # segment ends at every point, the corners of the outline have two
+    ends = {}
+    for x1, y1, x2, y2 in segments:
+        ends[(x1, y1)] = ends.get((x1, y1), 0) + 1
+        ends[(x2, y2)] = ends.get((x2, y2), 0) + 1
+    edges = {} # (pixel, traced point) of the polygons at every point
+    polygons = []
+    for x1, y1, x2, y2 in segments:
+        start, end = (x1, y1), (x2, y2)
+        # the light is on the outer side, or on the segment itself (then
+        # it shadows the whole half plane behind it)
+        side = (x2-x1)*(y+top-y1) - (y2-y1)*(x+left-x1)
+        if side > 0:
+            continue
+        touching = side == 0
+        if touching and not (min(x1, x2) <= x+left <= max(x1, x2) and
+                             min(y1, y2) <= y+top <= max(y1, y2)):
+            continue
+        # clipped to the bounds, only the part inside can shadow something
+        # inside
+        if y1 == y2:
+            if not top <= y1 <= bottom:
+                continue
+            low, high = max(min(x1, x2), left), min(max(x1, x2), right)
+            if low >= high:
+                continue
+            x1, x2 = (low, high) if x1 < x2 else (high, low)
+        else:
+            if not left <= x1 <= right:
+                continue
+            low, high = max(min(y1, y2), top), min(max(y1, y2), bottom)
+            if low >= high:
+                continue
+            y1, y2 = (low, high) if y1 < y2 else (high, low)
+        # move to mask coordinates
+        x1, y1, x2, y2 = x1 - left, y1 - top, x2 - left, y2 - top
+
+        # the edges go from the pixels of the area at the ends of the
+        # segment through the points tracePoint gives for them, like the
+        # ones of getPolygon
+        if touching:
+            # from the end of the segment, around its inner side
+            begin = math.atan2(y2 - y1, x2 - x1)
+            delta = math.pi
+        else:
+            begin = math.atan2(y2 - y, x2 - x)
+            delta = math.atan2(y1 - y, x1 - x) - begin
+            if delta > math.pi:
+                delta -= math.pi*2
+            elif delta <= -math.pi:
+                delta += math.pi*2
+        if y1 == y2:
+            if x2 < x1: # bottom side
+                polygon = [(x1-1, y1-1), (x2, y2-1)]
+            else: # top side
+                polygon = [(x1, y1), (x2-1, y2)]
+        elif y2 > y1: # right side
+            polygon = [(x1-1, y1), (x2-1, y2-1)]
+        else: # left side
+            polygon = [(x1, y1-1), (x2, y2)]
+        polygon.append(tracePoint(x, y, x2, y2, L))
+        steps = max(1, int(math.ceil(abs(delta) / step)))
+        for n in range(steps + 1):
+            angle = begin + delta*n/steps
+            polygon.append((x + math.cos(angle)*far, y + math.sin(angle)*far))
+        polygon.append(tracePoint(x, y, x1, y1, L))
+        polygons.append(polygon)
+        if start == (x1 + left, y1 + top): # not moved by the clipping
+            edges.setdefault(start, []).append((polygon[0], polygon[-1]))
+        if end == (x2 + left, y2 + top):
+            edges.setdefault(end, []).append((polygon[1], polygon[2]))
+
+    # At the inner corners the edges of the two sides start on different
+    # pixels of the area, the pixel in between shadows the gap they leave
+    # (a rect of its own for getPolygon)
+    for point, found in edges.items():
+        if ends[point] == 2 and len(found) == 2:
+            (pixel1, trace), (pixel2, _) = found
+            if pixel1 != pixel2:
+                polygons.append([pixel1, pixel2, trace])
+    return polygons
+
+def getPolarDepths(size, segments, bins, batch = True):
+    """
+    Returns the polar shadow map of a light (the 2D shadow map): for every
+    one of the given angular bins, the distance from the light to the
+    nearest segment along the ray through the middle of the bin, size if
+    none is nearer. Bin n covers the angles [n, n+1) * 2pi / bins, measured
+    like math.atan2 (y axis pointing down, so clockwise).
+    With numpy if asked and available, both give the same depths.
+    @size: radius of the light.
+    @segments: iterable of (x1, y1, x2, y2), relative to the light.
+    @bins: number of bins.
+    @return: list of floats.
+    """
+    segments = [tuple(s) for s in segments]
+    if batch and numpy is not None:
+        return _getPolarDepthsBatch(size, segments, bins)
+    return _getPolarDepthsScalar(size, segments, bins)
+
+def _getPolarDepthsScalar(size, segments, bins):
+    """
+    Goes segment by segment, only over the bins the segment spans (and one
+    more at each side).
+    """
+    step = 2*math.pi / bins
+    depths = [float(size)] * bins
+    directions = [(math.cos((n + 0.5)*step), math.sin((n + 0.5)*step)) for n in range(bins)]
+    for x1, y1, x2, y2 in segments:
+        ex, ey = x2 - x1, y2 - y1
+        first = math.atan2(y1, x1)
+        arc = math.atan2(y2, x2) - first
+        # shortest way from one end to the other
+        if arc > math.pi:
+            arc -= 2*math.pi
+        elif arc < -math.pi:
+            arc += 2*math.pi
+        if arc < 0:
+            first, arc = first + arc, -arc
+        start = int(math.floor(first/step - 0.5)) - 1
+        stop = int(math.floor((first + arc)/step - 0.5)) + 2
+        for n in range(start, stop):
+            n %= bins
+            c, s = directions[n]
+            denom = c*ey - s*ex
+            if denom == 0:
+                continue
+            t = (x1*ey - y1*ex) / denom
+            u = (x1*s - y1*c) / denom
+            if 0 <= u <= 1 and 0 <= t < depths[n]:
+                depths[n] = t
+    return depths
+
+def _getPolarDepthsBatch(size, segments, bins):
+    """
+    Numpy version of _getPolarDepthsScalar: the (segment, bin) pairs of the
+    spans of every segment are made and intersected all at once.
+    """
+    depths = numpy.full(bins, float(size))
+    if not segments:
+        return depths.tolist()
+    step = 2*math.pi / bins
+    angles = (numpy.arange(bins) + 0.5)*step
+    cos, sin = numpy.cos(angles), numpy.sin(angles)
+
+    data = numpy.array(segments, dtype = numpy.float64).reshape(-1, 4)
+    x1, y1, x2, y2 = data.T
+    first = numpy.arctan2(y1, x1)
+    arc = numpy.arctan2(y2, x2) - first
+    # shortest way from one end to the other
+    arc[arc > math.pi] -= 2*math.pi
+    arc[arc < -math.pi] += 2*math.pi
+    first = numpy.where(arc < 0, first + arc, first)
+    arc = numpy.abs(arc)
+    start = numpy.floor(first/step - 0.5).astype(numpy.intp) - 1
+    stop = numpy.floor((first + arc)/step - 0.5).astype(numpy.intp) + 2
+
+    # one row per (segment, bin) pair
+    counts = stop - start
+    segment = numpy.repeat(numpy.arange(len(data)), counts)
+    offsets = numpy.arange(len(segment)) - numpy.repeat(numpy.cumsum(counts) - counts, counts)
+    n = (start[segment] + offsets) % bins
+    x1, y1 = x1[segment], y1[segment]
+    ex, ey = x2[segment] - x1, y2[segment] - y1
+    c, s = cos[n], sin[n]
+    denom = c*ey - s*ex
+    with numpy.errstate(divide = 'ignore', invalid = 'ignore'):
+        t = (x1*ey - y1*ex) / denom
+        u = (x1*s - y1*c) / denom
+    valid = (denom != 0) & (u >= 0) & (u <= 1) & (t >= 0)
+    numpy.minimum.at(depths, n[valid], t[valid])
+    return depths.tolist()
+
+def getPolarBin(dx, dy, bins):
+    """
+    Returns the bin of getPolarDepths the given point (relative to the
+    light) falls in.
+    """
+    return int(math.floor(math.atan2(dy, dx) * bins / (2*math.pi))) % bins
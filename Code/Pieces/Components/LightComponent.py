@@ -1,10 +1,12 @@
 import larv
 from LightEngine import Light
 from ColorConstants import *
+from Globals import *
 
 class LightComponent(larv.Component):
     """
     Holds info about a light structure.
     """
-    def __init__(self, x, y, size = 100, alpha = None, color = WHITE):
-        self.light = Light(x, y, size, alpha, color)
+    def __init__(self, x, y, size = 100, alpha = None, color = WHITE, gradient = False,
+                 backend = LIGHT_BACKEND, resolution = LIGHT_RESOLUTION):
+        self.light = Light(x, y, size, alpha, color, gradient, backend, resolution)
@@ -151,15 +151,20 @@ class LevelEntityFactory(larv.EntityFactory):
         return new_entity    
 
     ### LIGHT
-    def createLight(self, x, y, size = 100, alpha = None, color = WHITE):
+    def createLight(self, x, y, size = 100, alpha = None, color = WHITE, gradient = GRADIENT_LIGHTS,
+                    backend = LIGHT_BACKEND, resolution = LIGHT_RESOLUTION):
         """
         @x,y: should be pygame coordinates
         @size: radius of the light
         @alpha: transparency, must be between 1 and 255
+        @gradient: bool, draw the light with a radial gradient
+        @backend: 'polygons' or 'raycast', how the light computes its shadows
+        @resolution: divisor (1, 2, 4...) of the size its mask is drawn at, or 'auto'
         """
         new_entity = self.entity_manager.createEntity()
 
-        new_light_component = LightComponent(x, y, size, alpha, color)
+        new_light_component = LightComponent(x, y, size, alpha, color, gradient, backend,
+                                             resolution)
         new_state_component = StateComponent('active')
 
         self.entity_manager.addComponent(new_entity, new_light_component)
@@ -168,16 +173,22 @@ class LevelEntityFactory(larv.EntityFactory):
         self.group_manager.add(new_entity, 'light')
         return new_entity
 
-    def createIntermitentLight(self, x, y, size = 100, alpha = None, color = WHITE, interval=1500):
+    def createIntermitentLight(self, x, y, size = 100, alpha = None, color = WHITE, interval=1500,
+                               gradient = GRADIENT_LIGHTS, backend = LIGHT_BACKEND,
+                               resolution = LIGHT_RESOLUTION):
         """
         @x,y: should be pygame coordinates
         @size: radius of the light
         @alpha: transparency, must be between 1 and 255
         @interval: miliseconds to be turned on/off
+        @gradient: bool, draw the light with a radial gradient
+        @backend: 'polygons' or 'raycast', how the light computes its shadows
+        @resolution: divisor (1, 2, 4...) of the size its mask is drawn at, or 'auto'
         """
         new_entity = self.entity_manager.createEntity()
 
-        new_light_component = LightComponent(x, y, size, alpha, color)
+        new_light_component = LightComponent(x, y, size, alpha, color, gradient, backend,
+                                             resolution)
         new_state_component = StateComponent('active')
         new_intermitent_component = IntermitentComponent(interval)
 
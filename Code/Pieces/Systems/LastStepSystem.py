@@ -1,5 +1,6 @@
 import larv
 
+from QualityGovernor import GOVERNOR
 from Globals import *
 
 class LastStepSystem(larv.System):
@@ -8,6 +9,7 @@ class LastStepSystem(larv.System):
       - Updates physics engine (if physics bool is True)
       - Updates pygame display
       - Sets the frame clock correctly
+      - Tells the quality governor how long the frame took
     """
     def __init__(self, physics = True):
         self.physics = physics
@@ -19,4 +21,6 @@ class LastStepSystem(larv.System):
         # Update the window (paint everything)
         pygame.display.flip()
         # Wait so FPS get accomplished
-        FPS_CLOCK.tick(FPS)
\ No newline at end of file
+        FPS_CLOCK.tick(FPS)
+        # Time the frame needed, without the wait
+        GOVERNOR.addFrame(FPS_CLOCK.get_rawtime())
\ No newline at end of file
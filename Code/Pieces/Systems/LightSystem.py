@@ -1,12 +1,18 @@
 # -*- coding: UTF-8 -*-
 import larv
 import helper
+import collections
 
 from ..Components import LightComponent
 from ..Components import PositionComponent
 from ..Components import LevelInfoComponent
 from ..Components import StateComponent
+from ..Components import RenderComponent
+from ..Components import IntermitentComponent
 
+from LightEngine import ObstructorGrid, LightMap, ShadowWorkers, LitField
+import LightGeometry
+from QualityGovernor import GOVERNOR
 from Globals import *
 from ColorConstants import *
 
@@ -17,13 +23,72 @@ class LightSystem(larv.System):
     And also takes info on:
         - Camera
     And does the following actions on them:
-        - Update the light
+        - Update the lights that changed (together, see ShadowWorkers)
         - Create mask if it wasn't created already
-        - Render them on screen
+        - Render them on screen (all at once, through a LightMap)
+        - Kill the hero if he is lit (static lights through a LitField)
+        - Follow the quality asked by the GOVERNOR
     """
     def __init__(self):
         self.first_time = True # optimization
 
+        # Spatial indexes over the obstructors, so every light only gets the
+        # ones it can reach
+        self.obstructor_grid = ObstructorGrid()
+        self.dynamic_obstructor_grid = ObstructorGrid()
+        self.dynamic_obstructor_handles = {} # entity id -> handle
+
+        # Dynamic obstructors every light holds, so only the ones that moved,
+        # appeared or left are pushed to it
+        self.light_obstructor_handles = {} # light entity id -> {entity id -> handle}
+
+        # Turned off lights (intermitent ones, mostly) whose obstructors changed
+        # since their mask was drawn. They are refreshed a few per frame while
+        # off, so turning them on is just a state flip.
+        self.stale_lights = collections.OrderedDict() # light entity id -> light
+
+        # Lights work in world coordinates, while the rects of the dynamic
+        # entities are moved to the screen by RenderSystem. Their world rects
+        # are kept here, updated in place.
+        self.dynamic_obstructor_rects = {} # entity id -> world rect
+        self.hero_rect = None # world rect
+        self.hero_screen_rect = None # where RenderSystem will draw the hero
+        self.hero_sprite = None # sprite the hero mask comes from
+        self.hero_mask = None # pygame.mask.Mask of the sprite of the hero
+
+        # All the lights get composited here and blitted to the screen at once
+        self.light_map = LightMap(WIN_WIDTH, WIN_HEIGHT)
+
+        # The lights to update in a frame are updated together, so their
+        # shadows can be computed concurrently
+        self.shadow_workers = ShadowWorkers()
+
+        # Part of the world on screen: lights out of it (and away from the
+        # hero) are skipped, and caught up when they come into view
+        self.viewport = pygame.Rect(0, 0, WIN_WIDTH, WIN_HEIGHT)
+
+        # What the static lights (always on, not intermitent) light with the
+        # static obstructors only, baked on the first update. While no
+        # dynamic obstructor reaches them, the hero is tested against it
+        # instead of against each of them.
+        self.lit_field = None
+        self.static_lights = {} # light entity id -> light
+        self.static_light_grid = ObstructorGrid() # rects of the static lights
+
+        # Quality the lights are drawn at, see QualityGovernor. Lights are
+        # switched to a new quality a few per frame, and then the lit field
+        # is baked again a few lights per frame too.
+        self.quality_version = None # GOVERNOR.version the lights were queued for
+        self.light_quality = {} # light entity id -> (gradient, resolution) it was made with
+        self.quality_queue = collections.OrderedDict() # light entity id -> light to switch
+        self.outdated_static_lights = set() # ids of the ones not baked as they are now
+        self.lit_field_baking = None # (LitField being baked, lights left to add)
+
+    def __del__(self):
+        # larv has no teardown for systems, the engine of a level drops them
+        # when the level changes or ends
+        self.shadow_workers.shutdown(False)
+
     def update(self):
         #### JUST FOR DEBUG PURPOSES
         level_info = self.group_manager.get('level_info')[0]
@@ -45,13 +110,22 @@ class LightSystem(larv.System):
         hero = self.group_manager.get('hero')[0]
         hero_pos_comp = self.entity_manager.getComponent(hero, PositionComponent.__name__)
         hero_state_comp = self.entity_manager.getComponent(hero, StateComponent.__name__)
+        if self.hero_rect is None:
+            self.hero_rect = hero_pos_comp.rect.copy()
+            self.hero_screen_rect = hero_pos_comp.rect.copy()
+        self.hero_rect.center = helper.xyToPygame(hero_pos_comp.x, hero_pos_comp.y)
+        hero_render_comp = self.entity_manager.getComponent(hero, RenderComponent.__name__)
+        if self.hero_sprite is not hero_render_comp.sprite:
+            self.hero_sprite = hero_render_comp.sprite
+            self.hero_mask = pygame.mask.from_surface(self.hero_sprite)
 
-        # Populate a list of the obstructors only if it's the first time we're
-        # updating the system
-        obstructors = []
+        # Index the obstructors only if it's the first time we're updating the
+        # system. Levels are built with tiles, the ones side by side are merged
+        # into bigger rects first (same area, less rects and sides).
         if self.first_time:
             if self.group_manager.doesGroupExist('obstructor'):
                 list_obstructors = self.group_manager.get('obstructor')            
+                rects = []
                 for obstructor in list_obstructors:
                     position_comp = self.entity_manager.getComponent(obstructor,
                                                         PositionComponent.__name__)
@@ -59,97 +133,277 @@ class LightSystem(larv.System):
                     # x = x - camera_x
                     # y = y + camera_y 
                     position_comp.rect.topleft = (x, y)
-                    obstructors.append(position_comp.rect)
+                    rects.append(position_comp.rect)
+                for rect in LightGeometry.mergeRects(rects):
+                    self.obstructor_grid.insert(pygame.Rect(rect))
 
-        # Create a list for temporal (auxiliar) obstructors
-        auxiliar_obstructors = []
-        # Add the dynamic obstructors to that list
+        # Keep the dynamic (auxiliar) obstructors indexed, moving them in their
+        # grid whenever they move
+        handles = self.dynamic_obstructor_handles
+        dynamic_rects = self.dynamic_obstructor_rects
+        present = set()
         if self.group_manager.doesGroupExist('dynamic_obstructor'):
             list_obstructors = self.group_manager.get('dynamic_obstructor')
             for obstructor in list_obstructors:
                 position_comp = self.entity_manager.getComponent(obstructor, PositionComponent.__name__)
-                auxiliar_obstructors.append(position_comp.rect)
+                present.add(obstructor.id)
+                if obstructor.id in handles:
+                    rect = dynamic_rects[obstructor.id]
+                    rect.center = helper.xyToPygame(position_comp.x, position_comp.y)
+                    self.dynamic_obstructor_grid.move(handles[obstructor.id], rect)
+                else:
+                    rect = position_comp.rect.copy()
+                    rect.center = helper.xyToPygame(position_comp.x, position_comp.y)
+                    dynamic_rects[obstructor.id] = rect
+                    handles[obstructor.id] = self.dynamic_obstructor_grid.insert(rect, obstructor.id)
+        for entity_id in list(handles):
+            if entity_id not in present:
+                self.dynamic_obstructor_grid.remove(handles.pop(entity_id))
+                del dynamic_rects[entity_id]
+
+        # Screen to world, see LightMap.toWorld (a pixel of margin for the
+        # rounding of the camera)
+        self.viewport.topleft = (int(camera_x) - 1, -int(camera_y) - 1)
+        self.viewport.size = (WIN_WIDTH + 2, WIN_HEIGHT + 2)
+        # lights barely on screen are left out when the quality is low
+        margin = GOVERNOR.light_cull_margin
+        if margin:
+            self.viewport.inflate_ip(-2*margin, -2*margin)
+
+        if self.quality_version != GOVERNOR.version:
+            self.queueQuality(list_entities)
+            self.quality_version = GOVERNOR.version
+        self.applyQuality()
+
+        # Lights that can be baked into the lit field
+        intermitent = set()
+        if self.first_time and IntermitentComponent.__name__ in self.entity_manager.components_by_class:
+            for entity in self.entity_manager.getEntitiesHavingComponents(IntermitentComponent.__name__):
+                intermitent.add(entity.id)
 
         # Update the lights
+        lights_on = [] # (entity id, light) to be drawn
+        lights_to_update = []
         for entity in list_entities:
             light_comp = self.entity_manager.getComponent(entity, LightComponent.__name__)
             state_comp = self.entity_manager.getComponent(entity, StateComponent.__name__)
 
-            # If mask isn't created, we initiate it
+            # If mask isn't created, we initiate it (placed in the world)
             if light_comp.light.mask is None:
                 light_comp.light.createMask()
+                light_comp.light.light_rect.center = helper.xyToPygame(light_comp.light.x,
+                                                                       light_comp.light.y)
+
+            # Bind the light to the static obstructors its radius can reach
+            if self.first_time:
+                # inflated so obstructors touching the border aren't missed
+                reachable = self.obstructor_grid.query(light_comp.light.light_rect.inflate(2, 2))
+                light_comp.light.setObstructors(reachable)
+
+            light = light_comp.light
+
+            # Lights always on go to the lit field
+            if (self.first_time and state_comp.state == 'active' and
+                    entity.id not in intermitent):
+                self.static_lights[entity.id] = light
+                self.static_light_grid.insert(light.light_rect.copy(), entity.id)
+
+            # Lights that can't be seen nor reach the hero cost nothing. Their
+            # obstructors are caught up when they come back (moveObstructor
+            # compares with what they had), but a light that was never drawn
+            # has to be refreshed anyway.
+            if not (light.light_rect.colliderect(self.viewport) or
+                    light.light_rect.colliderect(self.hero_rect)):
+                if self.first_time:
+                    self.stale_lights[entity.id] = light
+                continue
 
-            # If the light isn't active, don't update it
+            touched = self.updateDynamicObstructors(entity.id, light)
+
+            # If the light isn't active, don't update it now; its mask is kept
+            # and refreshed later if it isn't valid anymore
             if state_comp.state != 'active':
+                if self.first_time or touched:
+                    self.stale_lights[entity.id] = light
                 continue
 
-            # Update position
-            x, y = helper.xyToPygame(light_comp.light.x, light_comp.light.y)
-            x = x - camera_x
-            y = y + camera_y
-            light_comp.light.light_rect.center = x, y
-            
-            # Update obstructors
-            if not light_comp.light.obstructors:
-                light_comp.light.setObstructors(obstructors)
-            if auxiliar_obstructors:
-                light_comp.light.setObstructors(auxiliar_obstructors, auxiliar=True)
-
-            ## May need to apply some logic around the update
-            ## because it may be computationally intensive.
-            ## Currently, we just update if there are any dynamic obstructors and
-            ## or we are on the first update
-            if self.first_time:
-                # Update the constructors with the camera movement
-                light_comp.light.updateObstructors(camera_x, camera_y)
-                # Update the camera mask
-                light_comp.light.update() # Without dynamic objects we will only render the mask once!
-            elif auxiliar_obstructors:
-                # Update the constructors with the camera movement
-                light_comp.light.updateObstructors(camera_x, camera_y)
+            # Only rebuild the mask if it's the first update, the lit area was
+            # touched or it changed while the light was off; dynamic
+            # obstructors elsewhere cost nothing
+            stale = self.stale_lights.pop(entity.id, None) is not None
+            if self.first_time or touched or stale:
                 # Update the light (update it's mask to be rendered)
-                light_comp.light.update()
-                ## Only update if the any obstructor is inside the light area
-                # for obstructor in auxiliar_obstructors:
-                #     if light_comp.light.isRectInsideLight(obstructor, x, y,
-                #                                            camera_x, camera_y):
-                #         light_comp.light.update()
-                #         break
-
-            # Draw the light onto the screen
-            light_comp.light.blit(DISPLAYSURF)
-
-            # Hero is in light range -> kill him
-            hero_rect = hero_pos_comp.rect
-            # print(hero_rect.topleft)
-            if light_comp.light.isRectInsideLight(hero_rect, x, y, camera_x, camera_y):
-                hero_state_comp.state = 'dead'
-
-            # Clean the auxiliar obstructors
-            light_comp.light.cleanAuxiliar()
+                lights_to_update.append(light)
 
-        # Indicate that we have, at least, updated this system once
-        self.first_time = False
+            # Draw the light into the light map
+            lights_on.append((entity.id, light))
 
+        if self.first_time:
+            self.lit_field = LitField(self.static_lights.values())
+
+        # Refresh the masks of some turned off (or never drawn) lights, oldest
+        # first
+        for _ in range(min(LIGHT_INACTIVE_UPDATES, len(self.stale_lights))):
+            entity_id, light = self.stale_lights.popitem(last = False)
+            lights_to_update.append(light)
+        self.shadow_workers.updateLights(lights_to_update)
+
+        # Draw the lights onto the screen
+        self.light_map.update(lights_on, camera_x, camera_y)
+        self.light_map.blit(DISPLAYSURF)
+
+        # Hero touches a lit pixel -> kill him
+        # The hero is placed like RenderSystem will draw him and the lights
+        # like the light map drew them, so it matches what is on screen
+        x, y = self.hero_rect.center
+        self.hero_screen_rect.center = (x - camera_x, y + camera_y)
+        hero_x, hero_y = self.light_map.toWorld(*self.hero_screen_rect.topleft)
+        hero_world_rect = pygame.Rect((hero_x, hero_y), self.hero_screen_rect.size)
+        if self.isHeroLit(hero_world_rect, lights_on):
+            hero_state_comp.state = 'dead'
 
         #####
         #####
         ## DEBUG THINGS
-        if level_info_comp.debug:
+        if level_info_comp.debug and GOVERNOR.debug_overlays:
             # draw obstructors
             for entity in list_entities:
                 light_comp = self.entity_manager.getComponent(entity, LightComponent.__name__)
                 for obstructor in light_comp.light.obstructors + light_comp.light.auxiliar_obstructors:
-                    pygame.draw.rect(DISPLAYSURF, BLACK, obstructor, 3)
+                    pygame.draw.rect(DISPLAYSURF, BLACK, obstructor.move(-camera_x, camera_y), 3)
 
             # draw light 
             for entity in list_entities:
                 # draw rect
                 light_comp = self.entity_manager.getComponent(entity, LightComponent.__name__)
-                rect = light_comp.light.light_rect
+                rect = light_comp.light.light_rect.move(-camera_x, camera_y)
                 pygame.draw.rect(DISPLAYSURF, YELLOW, rect, 3)
 
                 # draw middle of rect
                 pygame.draw.circle(DISPLAYSURF, BLUE, rect.center, 3)
 
+        # Indicate that we have, at least, updated this system once
+        self.first_time = False
+
+    def getQuality(self, entity_id):
+        """
+        Returns the (gradient, resolution) the light of the given entity can
+        have at the quality level of the GOVERNOR.
+        """
+        gradient, resolution = self.light_quality[entity_id]
+        return gradient and GOVERNOR.gradient_lights, resolution * GOVERNOR.light_resolution
+
+    def queueQuality(self, list_entities):
+        """
+        Queues the lights whose gradient or resolution has to change to
+        follow the quality level of the GOVERNOR (see applyQuality). Lights
+        without mask yet are changed right away, it costs nothing.
+        @list_entities: the entities with a LightComponent.
+        """
+        for entity in list_entities:
+            light = self.entity_manager.getComponent(entity, LightComponent.__name__).light
+            if entity.id not in self.light_quality:
+                self.light_quality[entity.id] = (light.gradient, light.resolution)
+            gradient, resolution = self.getQuality(entity.id)
+            if light.mask is None:
+                light.setGradient(gradient)
+                light.setResolution(resolution)
+            elif (gradient, resolution) != (light.gradient, light.resolution):
+                self.quality_queue[entity.id] = light
+            else:
+                self.quality_queue.pop(entity.id, None)
+
+    def applyQuality(self):
+        """
+        Switches up to QUALITY_LIGHT_CHANGES of the queued lights to their new
+        quality. Their masks are made again but drawn like the ones of the
+        stale lights: right away if they are on screen, later otherwise.
+        Once every light is switched, the lit field is baked again (see
+        bakeLitField).
+        """
+        for _ in range(min(QUALITY_LIGHT_CHANGES, len(self.quality_queue))):
+            entity_id, light = self.quality_queue.popitem(last = False)
+            gradient, resolution = self.getQuality(entity_id)
+            light.setGradient(gradient, update = False)
+            light.setResolution(resolution, update = False)
+            self.stale_lights[entity_id] = light
+            if entity_id in self.static_lights:
+                self.outdated_static_lights.add(entity_id)
+                self.lit_field_baking = None
+        if self.outdated_static_lights and not self.quality_queue:
+            self.bakeLitField()
+
+    def bakeLitField(self):
+        """
+        Bakes the lit field again, up to QUALITY_LIGHT_CHANGES static lights
+        per call, from their static masks (see Light.getStaticBitmask). The
+        current field is used until the new one is complete, but for the
+        static lights whose quality changed.
+        """
+        if self.lit_field_baking is None:
+            lights = list(self.static_lights.values())
+            self.lit_field_baking = (LitField(lights, False), lights)
+        lit_field, lights = self.lit_field_baking
+        for _ in range(min(QUALITY_LIGHT_CHANGES, len(lights))):
+            lit_field.addLight(lights.pop())
+        if not lights:
+            self.lit_field = lit_field
+            self.lit_field_baking = None
+            self.outdated_static_lights.clear()
+
+    def isHeroLit(self, hero_world_rect, lights_on):
+        """
+        Returns a boolean depending on whether the hero mask, placed at the
+        given rect, touches a pixel drawn by any of the lights.
+        The static lights around the hero are asked to the lit field at once,
+        unless one of them is off, holds a dynamic obstructor or changed its
+        quality since it was baked (its mask isn't the baked one); then every
+        light is tested on its own.
+        @hero_world_rect: pygame.Rect, where the hero is drawn, in the world.
+        @lights_on: list of (entity id, light), the lights drawn this frame.
+        """
+        hero_x, hero_y = hero_world_rect.topleft
+        on = set(entity_id for entity_id, light in lights_on)
+        baked = True
+        for entity_id in self.static_light_grid.query(hero_world_rect):
+            if (entity_id not in on or self.light_obstructor_handles.get(entity_id) or
+                    entity_id in self.outdated_static_lights):
+                baked = False
+                break
+        if baked and self.lit_field.isMaskLit(self.hero_mask, hero_x, hero_y):
+            return True
+
+        for entity_id, light in lights_on:
+            if baked and entity_id in self.static_lights:
+                continue # already answered by the lit field
+            # broadphase: only the lights whose rect reaches the hero
+            if not light.light_rect.colliderect(hero_world_rect):
+                continue
+            if light.isMaskInsideLight(self.hero_mask, hero_x, hero_y):
+                return True
+        return False
 
+    def updateDynamicObstructors(self, entity_id, light):
+        """
+        Brings the dynamic obstructors of the given light up to date: the ones
+        that left are removed, the new ones added and the rest moved (a no-op
+        if they didn't).
+        @entity_id: id of the entity of the light.
+        @light: LightEngine.Light, already placed in the world.
+        @return: bool, if any of the changes touched the lit area.
+        """
+        dynamic_rects = self.dynamic_obstructor_rects
+        light_handles = self.light_obstructor_handles.setdefault(entity_id, {})
+        touched = False
+        for obstructor_id in list(light_handles):
+            if (obstructor_id not in dynamic_rects or
+                    not dynamic_rects[obstructor_id].colliderect(light.light_rect)):
+                touched |= light.removeObstructor(light_handles.pop(obstructor_id))
+        for obstructor_id in self.dynamic_obstructor_grid.query(light.light_rect):
+            if obstructor_id in light_handles:
+                touched |= light.moveObstructor(light_handles[obstructor_id],
+                                                dynamic_rects[obstructor_id])
+            else:
+                light_handles[obstructor_id], inserted = light.insertObstructor(dynamic_rects[obstructor_id])
+                touched |= inserted
+        return touched
@@ -8,6 +8,7 @@ from ..Components import PhysicsComponent
 from ..Components import LevelInfoComponent
 from ..Components import StateComponent
 
+from QualityGovernor import GOVERNOR
 from Globals import *
 from ColorConstants import *
 
@@ -64,7 +65,7 @@ class RenderSystem(larv.System):
         ## DEBUG THINGS
         if not has_level_info:
             return
-        if level_info_comp.debug:
+        if level_info_comp.debug and GOVERNOR.debug_overlays:
             # paint collision
             list_entities = self.group_manager.get('collision')
             for entity in list_entities:
@@ -0,0 +1,115 @@
+# -*- coding: UTF-8 -*-
+"""
+Adaptive quality: watches how long the frames take and, while they overrun
+the budget of the frame rate, degrades the expensive features one step at a
+time (restoring them, last degraded first, when there is room again).
+The systems read the current quality from GOVERNOR.
+"""
+import collections
+
+from Globals import *
+
+class QualityGovernor:
+    """
+    Keeps the mean work time of the last frames (see addFrame) and moves
+    between quality levels: level 0 is full quality, every level above
+    degrades one more of STEPS, in order.
+
+    Usage:
+     - Every frame: GOVERNOR.addFrame(milliseconds of work)
+     - Systems check the features: GOVERNOR.debug_overlays,
+       GOVERNOR.gradient_lights, GOVERNOR.light_resolution and
+       GOVERNOR.light_cull_margin. GOVERNOR.version changes every time the
+       level does.
+    """
+    # Features in the order they are degraded, cheapest to lose first
+    STEPS = ('debug_overlays', 'gradient_lights', 'light_resolution', 'light_culling')
+
+    def __init__(self, fps = FPS, enabled = QUALITY_GOVERNOR, log = QUALITY_LOG):
+        """
+        @fps: frame rate to keep, the budget of a frame is 1000/fps ms.
+        @enabled: if False, addFrame does nothing and the quality stays full.
+        @log: whether to print every change of level (they are always kept
+              in transitions).
+        """
+        self.budget = 1000.0 / fps # ms
+        self.enabled = enabled
+        self.frames = collections.deque(maxlen = QUALITY_WINDOW) # ms of the last frames
+        self.frames_since_change = 0
+        self.level = 0
+        self.version = 0 # changes with the level
+        self.log = log
+        self.transitions = collections.deque(maxlen = 100) # last changes, as logged
+
+    def addFrame(self, work_time):
+        """
+        Takes the time the last frame needed (without the wait for the frame
+        rate, see pygame.time.Clock.get_rawtime) and changes the quality level
+        if the mean of the last QUALITY_WINDOW frames asks for it.
+        @work_time: milliseconds.
+        """
+        if not self.enabled:
+            return
+        self.frames.append(work_time)
+        self.frames_since_change += 1
+        if len(self.frames) < self.frames.maxlen:
+            return
+        mean = sum(self.frames) / len(self.frames)
+        if mean > self.budget * QUALITY_DEGRADE_RATIO and self.level < len(self.STEPS):
+            self.setLevel(self.level + 1, mean)
+        elif (mean < self.budget * QUALITY_RESTORE_RATIO and self.level > 0 and
+                self.frames_since_change >= QUALITY_RESTORE_DELAY):
+            self.setLevel(self.level - 1, mean)
+
+    def setLevel(self, level, mean = None):
+        """
+        Changes the quality level, logging the transition (see log).
+        @level: 0 (full quality) to len(STEPS).
+        @mean: mean frame time that made it change, for the log.
+        """
+        if not 0 <= level <= len(self.STEPS):
+            raise ValueError('Invalid quality level')
+        if level == self.level:
+            return
+        if level > self.level:
+            change = 'degraded ' + ', '.join(self.STEPS[self.level:level])
+        else:
+            change = 'restored ' + ', '.join(self.STEPS[level:self.level])
+        reason = '' if mean is None else ' (mean frame %.1f ms, budget %.1f ms)' % (mean, self.budget)
+        transition = 'Quality level %d -> %d: %s%s' % (self.level, level, change, reason)
+        self.transitions.append(transition)
+        if self.log:
+            print(transition)
+        self.level = level
+        self.version += 1
+        # the next decision waits for a whole window of the new level
+        self.frames.clear()
+        self.frames_since_change = 0
+
+    def isDegraded(self, step):
+        """
+        Tells if the given feature (one of STEPS) is degraded at this level.
+        """
+        return self.STEPS.index(step) < self.level
+
+    @property
+    def debug_overlays(self):
+        """Whether the debug drawings (LevelInfoComponent.debug) can be drawn."""
+        return not self.isDegraded('debug_overlays')
+
+    @property
+    def gradient_lights(self):
+        """Whether lights asked to have a gradient can draw it."""
+        return not self.isDegraded('gradient_lights')
+
+    @property
+    def light_resolution(self):
+        """Factor the resolution divisor of every light is multiplied by."""
+        return QUALITY_LIGHT_RESOLUTION if self.isDegraded('light_resolution') else 1
+
+    @property
+    def light_cull_margin(self):
+        """Pixels a light has to reach into the screen to be drawn."""
+        return QUALITY_LIGHT_CULL_MARGIN if self.isDegraded('light_culling') else 0
+
+GOVERNOR = QualityGovernor()
@@ -0,0 +1,573 @@
+import pygame
+from pygame.locals import *
+import pymunk
+from pymunk.vec2d import Vec2d
+import math
+import bisect
+
+from ColorConstants import *
+from helper import *
+import helper
+
+##### RAYCASTING : http://www.redblobgames.com/articles/visibility/
+class Raycast:
+    """
+    Provides a method to form light from a source up to given obstacles.
+    Based on a system that gets information on what the central point (light)
+    can 'see' (field of vision).
+
+    Segments may touch, overlap (like adjacent tiles do) or cross. The ones
+    crossing are first split where they cross (see getSweepSegments), then
+    the sweep sorts the endpoints by angle and walks them keeping the
+    segments the sweeping ray goes through (the open ones) in a list sorted
+    by distance to the center. As no two of them cross, that order holds
+    while both are open, so every endpoint inserts or removes its segment
+    with a binary search and the one in front is the first one: the sweep
+    is O((n + c) log n), c being the crossings (none between the sides of
+    an outline, see LightGeometry.getOutlineSegments).
+
+    Usage:
+      - Create an instance of the class: raycast = Raycast()
+      - Add the rects or segments that should block the light.
+            - raycast.addSegment
+            - raycast.addRect(rect)
+            - raycast.addRectList(rect_list)
+      - Add the limits of the light: raycast.setBorder(x, y, width, height, input)
+      - Set the light location using: raycast.setLightLocation(x, y, input)
+      - Update the light using: raycast.sweep()
+      - Then you can draw the result using raycast.blit(surface, color, alpha)
+        or ask what the light sees with raycast.isPointVisible(x, y)
+    """
+    def __init__(self):
+        self.segments = []
+        self.endpoints = []
+        self.center = (0, 0)
+        self.output = [] # (begin, end) points of every triangle that is lit
+        self.wedges = [] # (angle1, angle2, segment) that output comes from
+        self.wedge_angles = [] # angle1 of every wedge, to search them
+
+    #### ENGINE
+    @staticmethod
+    def rayDistance(segment, origin, dx, dy):
+        """
+        Returns the distance from the origin to the segment line following
+        the given direction, infinite if they are parallel.
+        @segment: Segment instance
+        @origin: (x, y) tuple
+        @dx, dy: unitary direction of the ray
+        """
+        sx = segment.p2.x - segment.p1.x
+        sy = segment.p2.y - segment.p1.y
+        denominator = dx*sy - dy*sx
+        if denominator == 0:
+            return float('inf')
+        return ((segment.p1.x - origin[0])*sy - (segment.p1.y - origin[1])*sx) / denominator
+
+    def getSweepSegments(self):
+        """
+        Returns the segments to sweep: the ones added, but the ones crossing
+        others split at the crossing points, so that no two of them cross
+        (touching at an endpoint isn't crossing). Only the pairs whose
+        bounding boxes overlap get tested, found going through the segments
+        sorted by their left end.
+        To be used after setLightLocation (the new endpoints get their angles).
+        """
+        boxes = sorted((min(s.p1.x, s.p2.x), max(s.p1.x, s.p2.x),
+                        min(s.p1.y, s.p2.y), max(s.p1.y, s.p2.y), n)
+                       for n, s in enumerate(self.segments))
+        cuts = {} # segment index -> crossing points (t along the segment)
+        active = []
+        for box in boxes:
+            left, right, top, bottom, n = box
+            active = [other for other in active if other[1] >= left]
+            segment = self.segments[n]
+            px, py = segment.p1.x, segment.p1.y
+            rx, ry = segment.p2.x - px, segment.p2.y - py
+            for other_box in active:
+                if other_box[3] < top or other_box[2] > bottom:
+                    continue
+                m = other_box[4]
+                other = self.segments[m]
+                sx = other.p2.x - other.p1.x
+                sy = other.p2.y - other.p1.y
+                denominator = rx*sy - ry*sx
+                if denominator == 0:
+                    continue
+                qx = other.p1.x - px
+                qy = other.p1.y - py
+                t = (qx*sy - qy*sx) / denominator
+                u = (qx*ry - qy*rx) / denominator
+                if 0 < t < 1 and 0 < u < 1:
+                    cuts.setdefault(n, []).append(t)
+                    cuts.setdefault(m, []).append(u)
+            active.append(box)
+        if not cuts:
+            return self.segments
+
+        segments = []
+        for n, segment in enumerate(self.segments):
+            if n not in cuts:
+                segments.append(segment)
+                continue
+            x1, y1 = segment.p1.x, segment.p1.y
+            dx, dy = segment.p2.x - x1, segment.p2.y - y1
+            points = [(x1, y1)] + [(x1 + t*dx, y1 + t*dy) for t in sorted(cuts[n])] + \
+                     [(segment.p2.x, segment.p2.y)]
+            for point1, point2 in zip(points, points[1:]):
+                piece = Raycast.makeSegment(point1, point2, segment.border)
+                self.setSegmentAngles(piece)
+                segments.append(piece)
+        return segments
+
+    @staticmethod
+    def searchOpen(open_segments, distance, dx, dy):
+        """
+        Binary search in the open segments (sorted by distance along the ray
+        of the given direction), returns the index of the first one not
+        nearer than distance.
+        """
+        low, high = 0, len(open_segments)
+        while low < high:
+            middle = (low + high) // 2
+            x, y, sx, sy = open_segments[middle].ray
+            denominator = dx*sy - dy*sx
+            if denominator != 0 and (x*sy - y*sx) / denominator < distance:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    @staticmethod
+    def getOpenDistance(segment, dx, dy):
+        """
+        Same as rayDistance from the center, with the ray data of the sweep.
+        """
+        x, y, sx, sy = segment.ray
+        denominator = dx*sy - dy*sx
+        if denominator == 0:
+            return float('inf')
+        return (x*sy - y*sx) / denominator
+
+    def insertOpen(self, open_segments, segment, angle):
+        """
+        Inserts the segment in the open ones, keeping them sorted by distance
+        along the ray of the given angle (any angle all of them span).
+        """
+        dx, dy = math.cos(angle), math.sin(angle)
+        distance = Raycast.getOpenDistance(segment, dx, dy)
+        open_segments.insert(Raycast.searchOpen(open_segments, distance, dx, dy), segment)
+
+    def removeOpen(self, open_segments, segment, angle):
+        """
+        Removes the segment from the open ones, searching it along the ray
+        of the given angle (any angle all of them span). Does nothing if it
+        isn't there.
+        """
+        dx, dy = math.cos(angle), math.sin(angle)
+        distance = Raycast.getOpenDistance(segment, dx, dy)
+        n = Raycast.searchOpen(open_segments, distance - 1e-9, dx, dy)
+        while n < len(open_segments):
+            if open_segments[n] is segment:
+                del open_segments[n]
+                return
+            if Raycast.getOpenDistance(open_segments[n], dx, dy) > distance + 1e-9:
+                break
+            n += 1
+        # rounding put it somewhere else
+        for n, other in enumerate(open_segments):
+            if other is segment:
+                del open_segments[n]
+                return
+
+    def sweep(self, max_angle = 999.0):
+        """
+        Run the algorithm.
+        Sweeps around a circle to find which areas are to be drawn.
+        Fills the output list with vertices of the triangles to be drawn and
+        the wedges list with the segment that limits every one of them.
+        @max_angle: in degrees, maximum angle evaluated.
+        """
+        self.output = [] #restart
+        self.wedges = []
+
+        segments = self.getSweepSegments()
+        cx, cy = self.center
+        for segment in segments:
+            # what getOpenDistance needs
+            segment.ray = (segment.p1.x - cx, segment.p1.y - cy,
+                           segment.p2.x - segment.p1.x, segment.p2.y - segment.p1.y)
+        endpoints = [p for s in segments for p in (s.p1, s.p2) if s.p1.begin != s.p2.begin]
+        endpoints.sort(key=lambda p: (p.angle, not p.begin))
+
+        # First pass: find the segments crossed by the ray at angle -pi
+        # (the ones that begin before pi and end after -pi)
+        wrapped = set()
+        for p in endpoints:
+            if p.begin:
+                wrapped.add(p.segment)
+            else:
+                wrapped.discard(p.segment)
+
+        # Second pass: between every two consecutive endpoint angles the open
+        # segments keep their order, the nearest one is in front
+        end_angle = min(math.pi, -math.pi + math.radians(max_angle))
+        begin_angle = -math.pi
+        open_segments = [] # sorted by distance to the center
+        pending = list(wrapped) # to be inserted in the first interval
+        previous = None # middle angle of the previous interval
+        n = 0
+        while begin_angle < end_angle:
+            begun = []
+            ended = []
+            while n < len(endpoints) and endpoints[n].angle <= begin_angle:
+                p = endpoints[n]
+                if p.begin:
+                    begun.append(p.segment)
+                else:
+                    ended.append(p.segment)
+                n += 1
+            angle = min(endpoints[n].angle if n < len(endpoints) else math.pi, end_angle)
+            middle = (begin_angle + angle)/2
+
+            # the ones ending go before the new ones come, they are searched
+            # where all of them were open
+            if previous is not None:
+                for segment in ended:
+                    self.removeOpen(open_segments, segment, previous)
+            ended = set(ended)
+            for segment in pending + begun:
+                # beginning and ending at once, covers no angle
+                if segment not in ended:
+                    self.insertOpen(open_segments, segment, middle)
+            pending = []
+
+            front = open_segments[0] if open_segments else None
+            if self.wedges and self.wedges[-1][2] is front:
+                self.wedges[-1] = (self.wedges[-1][0], angle, front)
+            else:
+                self.wedges.append((begin_angle, angle, front))
+            previous = middle
+            begin_angle = angle
+
+        self.wedge_angles = [wedge[0] for wedge in self.wedges]
+        for angle1, angle2, segment in self.wedges:
+            self.addTriangle(angle1, angle2, segment)
+
+    @staticmethod
+    def lineIntersection(p1, p2, p3, p4):
+        """
+        Info: http://paulbourke.net/geometry/lineline2d/
+        @arguments: (x, y) tuples
+        """
+        try:
+            s = ((p4[0] - p3[0]) * (p1[1] - p3[1]) - (p4[1] - p3[1]) * (p1[0] - p3[0]))/ \
+                ((p4[1] - p3[1]) * (p2[0] - p1[0]) - (p4[0] - p3[0]) * (p2[1] - p1[1]))
+        except ZeroDivisionError:
+            s = 0
+        return (p1[0] + s*(p2[0] - p1[0]), p1[1] + s*(p2[1] - p1[1]))
+
+    def getRayPoint(self, angle, segment, distance = 500):
+        """
+        Returns the point where the ray with the given angle meets the given
+        segment (or at a fixed distance if there is no segment).
+        @angle: radians
+        @segment: Segment instance or None.
+        """
+        cx, cy = self.center
+        p2 = (cx + math.cos(angle), cy + math.sin(angle))
+        if segment is None:
+            # Stop the triangle at a fixed distance, can only happen if no
+            # border was given
+            return (cx + math.cos(angle) * distance, cy + math.sin(angle) * distance)
+        # Stop the triangle at the intersecting segment
+        p3 = (segment.p1.x, segment.p1.y)
+        p4 = (segment.p2.x, segment.p2.y)
+        return Raycast.lineIntersection(p3, p4, self.center, p2)
+
+    def addTriangle(self, angle1, angle2, segment):
+        """
+        Stores the triangle formed by the given angles and the given segment into
+        the output list.
+        @angle1, angle2: radians
+        @segment: Segment instance.
+        """
+        p_begin = self.getRayPoint(angle1, segment)
+        p_end = self.getRayPoint(angle2, segment)
+        self.output.append((p_begin, p_end))
+
+    def getShadowPolygons(self, distance):
+        """
+        Returns the polygons of the areas that aren't visible: one for every
+        wedge limited by an obstructor (not a border), going from the segment
+        up to the given distance.
+        To be used after sweep().
+        @distance: the polygons must reach at least this far from the center.
+        """
+        cx, cy = self.center
+        step = math.pi/4 # keeps the far side of the polygon further than distance
+        far = distance / math.cos(step/2)
+        polygons = []
+        for (angle1, angle2, segment), (p_begin, p_end) in zip(self.wedges, self.output):
+            if segment is None or segment.border:
+                continue
+            polygon = [p_begin, p_end]
+            angle = angle2
+            while True:
+                polygon.append((cx + math.cos(angle)*far, cy + math.sin(angle)*far))
+                if angle <= angle1:
+                    break
+                angle = max(angle - step, angle1)
+            polygons.append(polygon)
+        return polygons
+
+    def isPointVisible(self, x, y):
+        """
+        Returns a boolean depending on whether the center can see the given
+        point (points over an obstructor edge facing the center are seen).
+        To be used after sweep(), O(log n).
+        @x, y: point coordinates
+        """
+        if not self.wedges:
+            return True
+        cx, cy = self.center
+        dx = x - cx
+        dy = y - cy
+        distance = math.sqrt(dx*dx + dy*dy)
+        if distance == 0:
+            return True
+        n = bisect.bisect_right(self.wedge_angles, math.atan2(dy, dx)) - 1
+        segment = self.wedges[max(n, 0)][2]
+        if segment is None:
+            return True
+        return distance <= Raycast.rayDistance(segment, self.center, dx/distance, dy/distance) + 1e-6
+
+    #### CONVENIENCE METHODS
+    def addSegment(self, point1, point2, border=False):
+        """
+        @point1, point2: (x, y) tuples or vec2d instances.
+        @border: whether the segment is a limit of the light instead of an
+                 obstructor.
+        """
+        segment = Raycast.makeSegment(point1, point2, border)
+        self.segments.append(segment)
+        self.endpoints.append(segment.p1)
+        self.endpoints.append(segment.p2)
+
+    @staticmethod
+    def makeSegment(point1, point2, border=False):
+        """
+        Returns a new Segment instance with its endpoints.
+        @point1, point2: (x, y) tuples or vec2d instances.
+        """
+        p1 = EndPoint(x=point1[0], y=point1[1], begin=False, segment=None, angle=0.0)
+        p2 = EndPoint(x=point2[0], y=point2[1], begin=False, segment=None, angle=0.0)
+
+        segment = Segment(p1, p2, 0.0, border)
+        p1.segment = segment
+        p2.segment = segment
+        return segment
+
+    def addRect(self, rect, border=False):
+        """
+        Adds the given rect to the engine.
+        @rect: pygame.Rect instance.
+        """
+        assert isinstance(rect, pygame.Rect)
+        top_left = rect.topleft
+        bottom_left = rect.bottomleft
+        top_right = rect.topright
+        bottom_right = rect.bottomright
+
+        self.addSegment(top_left, bottom_left, border)
+        self.addSegment(bottom_left, bottom_right, border)
+        self.addSegment(bottom_right, top_right, border)
+        self.addSegment(top_right, top_left, border)
+
+    def addRectList(self, rect_list, border=False):
+        """
+        Given a list of pygame.Rect objects, adds all of them to the engine.
+        """
+        for rect in rect_list:
+            self.addRect(rect, border)
+
+    def addFacingRectList(self, rect_list, x, y):
+        """
+        Given a list of pygame.Rect objects, adds the sides of them that face
+        the point (x, y), the only ones that can be seen from it. Sides on
+        the same line that touch or overlap are joined into one segment
+        (floors made of tiles end up as a single segment).
+        @rect_list: list of pygame.Rect objects not containing the point.
+        @x, y: point the rects are seen from, the light location.
+        """
+        horizontal = {} # y -> [(x1, x2)]
+        vertical = {} # x -> [(y1, y2)]
+        for rect in rect_list:
+            if y < rect.top:
+                horizontal.setdefault(rect.top, []).append((rect.left, rect.right))
+            elif y > rect.bottom:
+                horizontal.setdefault(rect.bottom, []).append((rect.left, rect.right))
+            if x < rect.left:
+                vertical.setdefault(rect.left, []).append((rect.top, rect.bottom))
+            elif x > rect.right:
+                vertical.setdefault(rect.right, []).append((rect.top, rect.bottom))
+
+        for lines, horizontal_lines in ((horizontal, True), (vertical, False)):
+            for position, intervals in lines.items():
+                intervals.sort()
+                begin, end = intervals[0]
+                for interval in intervals[1:] + [(float('inf'), None)]:
+                    if interval[0] <= end:
+                        end = max(end, interval[1])
+                        continue
+                    if horizontal_lines:
+                        self.addSegment((begin, position), (end, position))
+                    else:
+                        self.addSegment((position, begin), (position, end))
+                    begin, end = interval
+
+    def addFacingSegmentList(self, segment_list, x, y):
+        """
+        Given a list of segments going clockwise around the obstructors (as
+        outlines are, see LightGeometry.getOutlineSegments), adds the ones
+        that face the point (x, y).
+        @segment_list: list of (x1, y1, x2, y2) tuples.
+        @x, y: point the segments are seen from, the light location.
+        """
+        for x1, y1, x2, y2 in segment_list:
+            # the point is on the outer side
+            if (x2-x1)*(y-y1) - (y2-y1)*(x-x1) < 0:
+                self.addSegment((x1, y1), (x2, y2))
+
+    def setBorder(self, x, y, width, height, input = 'pygame'):
+        """
+        Adds the outer limit of the light.
+        @x,y: coordinates of the middle (see input)
+        @width, height: int
+        @input: can be either 'pygame' or 'pymunk' (0,0 top_left, 0,0 bottom_left)
+        """
+        if input == 'pymunk':
+            x, y = helper.toPygame(Vec2d(x,y))
+
+        x = x - width//2
+        y = y - height//2
+        border_rect = pygame.Rect(x, y, width, height)
+        self.addRect(border_rect, border=True)
+
+    def setBorderWithSize(self, x, y, size, input = 'pygame'):
+        """
+        Adds the outer limit of the light.
+        @x,y: coordinates of the middle (see input)
+        @size: int
+        @input: can be either 'pygame' or 'pymunk' (0,0 top_left, 0,0 bottom_left)
+        """
+        self.setBorder(x, y, size, size, input)
+
+    def setLightLocation(self, x, y, input = 'pygame'):
+        """
+        @x,y: light coordinates
+        @input: can be either pygame ((0,0) topleft) or pymunk((0,0) bottomleft)
+        """
+        if input == 'pygame':
+            self.center = (x, y)
+        elif input == 'pymunk':
+            x, y = helper.toPygame(Vec2d(x, y))
+            self.center = (x, y)
+        else:
+            raise ValueError('bad input argument')
+
+        for segment in self.segments:
+            self.setSegmentAngles(segment)
+
+    def setSegmentAngles(self, segment):
+        """
+        Sets the distance of the segment and the angles of its endpoints, as
+        seen from the light location.
+        """
+        x, y = self.center
+        dx = 0.5 * (segment.p1.x + segment.p2.x) - x
+        dy = 0.5 * (segment.p1.y + segment.p2.y) - y
+        segment.d = dx*dx + dy*dy
+
+        segment.p1.angle = math.atan2(segment.p1.y - y, segment.p1.x - x)
+        segment.p2.angle = math.atan2(segment.p2.y - y, segment.p2.x - x)
+
+        d_angle = segment.p2.angle - segment.p1.angle
+        if d_angle <= -math.pi:
+            d_angle += math.pi * 2
+        if d_angle > math.pi:
+            d_angle -= math.pi * 2
+
+        # segments pointing to the light or going through it don't block
+        # anything, both of their endpoints are left as not begin so the
+        # sweep skips them
+        segment.p1.begin = (0.0 < d_angle < math.pi)
+        segment.p2.begin = (d_angle < 0.0)
+
+    def blit(self, surface, color = WHITE, alpha = None):
+        """
+        Blits the output of the sweep algorithm into the given surface.
+        """
+        copied = surface.copy() # convert imporves render speed
+        if alpha:
+            copied.set_alpha(alpha)
+
+        center = self.center
+        for vertices in self.output:
+            v1 = vertices[0]
+            v2 = vertices[1]
+            vertices_draw = (center, v1,v2, center)
+            pygame.draw.polygon(copied, color, vertices_draw)
+
+        surface.blit(copied, (0,0))
+
+    def clean(self):
+        """Empties containers."""
+        self.segments = []
+        self.endpoints = []
+        self.output = []
+        self.wedges = []
+        self.wedge_angles = []
+
+    def isRectInsideLight(self, rect):
+        """
+        Returns a boolean depending on whether the given rect is inside the light
+        range (any of its vertices can be seen from the center).
+        To be used after sweep(), else will return always True.
+        @rect: pygame.Rect instance
+        """
+        for x, y in (rect.topleft, rect.topright, rect.bottomright, rect.bottomleft):
+            if self.isPointVisible(x, y):
+                return True
+        return False
+
+class Segment:
+    def __init__(self, p1, p2, d = 0.0, border = False):
+        """
+        @p1, p2: must be EndPoint instances
+        @d: distance (float)
+        @border: bool, the segment is a limit of the light
+        """
+        self.p1 = p1
+        self.p2 = p2
+        self.d = d
+        self.border = border
+        self.ray = None # (x1, y1, dx, dy) relative to the center, set by sweep
+
+class EndPoint:
+    def __init__(self, x, y, begin, segment, angle):
+        """
+        @x, y: position
+        @begin: boolean
+        @segment: Segment instance
+        @angle: in radians
+        """
+        self.x = x
+        self.y = y
+        self.begin = begin
+        self.segment = segment
+        self.angle = angle
+
+    def __str__(self):
+        string = 'EndPoint <x,y = {0},{1}, begin={2}, seg={3}, angle={4}>'.format(
+                         self.x, self.y, self.begin, self.segment, self.angle)
+        return string
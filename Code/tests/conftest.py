@@ -0,0 +1,30 @@
+# -*- coding: UTF-8 -*-
+"""
+The modules of the game are imported from the Code folder, like Shades.py
+does. No window nor sound is needed.
+"""
+import os
+import sys
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+class SilentSound(object):
+    """
+    Stands for pygame.mixer.Sound. Globals loads the sounds with Windows
+    paths relative to the Code folder, they can't be found anywhere else.
+    """
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: None
+
+try:
+    import pygame.mixer
+except ImportError: # the tests needing it are skipped
+    pass
+else:
+    pygame.mixer.Sound = SilentSound
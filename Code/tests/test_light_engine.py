@@ -0,0 +1,189 @@
+# -*- coding: UTF-8 -*-
+import random
+
+import pytest
+
+# Globals (imported by LightEngine) sets up pymunk, larv and the window
+pytest.importorskip('pymunk', reason = 'Globals (imported by LightEngine) needs pymunk')
+pytest.importorskip('larv', reason = 'Globals (imported by LightEngine) needs larv')
+pygame = pytest.importorskip('pygame', reason = 'the lights draw with pygame')
+
+import LightEngine
+from LightEngine import Light
+
+def makeLight(x = 100, y = 100, size = 50, obstructors = (), **kwargs):
+    light = Light(x, y, size, **kwargs)
+    light.createMask()
+    light.setObstructors([pygame.Rect(r) for r in obstructors])
+    return light
+
+def maskPixels(light):
+    return pygame.image.tostring(light.getLayer(), 'RGBA')
+
+@pytest.fixture
+def mask_cache(monkeypatch):
+    """
+    A budget of its own for the mask caches of the test, room for 5 masks
+    of the default light.
+    """
+    budget = LightEngine.MaskCacheBudget(5 * 100 * 100)
+    monkeypatch.setattr(LightEngine, 'MASK_CACHE', budget)
+    return budget
+
+def test_mask_cache_hits_when_the_obstructors_come_back(mask_cache):
+    light = makeLight(obstructors = [(60, 60, 10, 10)])
+    handle, _ = light.insertObstructor(pygame.Rect(110, 110, 10, 10))
+    light.update()
+    first = maskPixels(light)
+    light.moveObstructor(handle, pygame.Rect(80, 120, 10, 10))
+    light.update()
+    assert maskPixels(light) != first
+    light.moveObstructor(handle, pygame.Rect(110, 110, 10, 10))
+    light.update()
+    assert light.mask_cache_hits == 1
+    assert light.mask_cache_misses == 2
+    assert maskPixels(light) == first
+
+def test_mask_cache_evicts_the_least_recently_used(mask_cache):
+    light = makeLight()
+    light.mask_cache_limit = 3 * 100 * 100
+    handle, _ = light.insertObstructor(pygame.Rect(110, 110, 10, 10))
+    keys = []
+    for n in range(5):
+        light.moveObstructor(handle, pygame.Rect(60 + n*10, 110, 10, 10))
+        light.update()
+        keys.append(light.getMaskKey())
+    assert list(light.mask_cache) == keys[2:]
+    assert light.mask_cache_memory <= light.mask_cache_limit
+
+def test_mask_cache_budget_is_shared_by_the_lights(mask_cache):
+    rng = random.Random(0)
+    lights = [makeLight(100 + 20*n, 100) for n in range(6)]
+    handles = [light.insertObstructor(pygame.Rect(100, 130, 10, 10))[0] for light in lights]
+    for _ in range(200):
+        n = rng.randrange(len(lights))
+        lights[n].moveObstructor(handles[n], pygame.Rect(rng.randrange(60, 200, 4),
+                                                         rng.randrange(60, 140, 4), 10, 10))
+        lights[n].update()
+        assert mask_cache.memory <= mask_cache.memory_limit
+        assert mask_cache.memory == sum(light.mask_cache_memory for light in lights)
+        for light in lights:
+            # the current mask is never taken from a light, cached or not
+            assert not light.mask_is_cached or any(mask is light.mask
+                                                   for mask in light.mask_cache.values())
+    assert sum(light.mask_cache_hits for light in lights) > 0
+
+def test_layer_pool_gives_the_least_recently_used_layer(monkeypatch):
+    # room for the layers of 2 lights
+    pool = LightEngine.LayerPool(2 * 100 * 100 * 4)
+    monkeypatch.setattr(LightEngine, 'LAYER_POOL', pool)
+    lights = [makeLight(100 + 30*n, 100, obstructors = [(120 + 30*n, 90, 10, 20)])
+              for n in range(3)]
+    layers = []
+    for light in lights:
+        light.update()
+        layers.append(maskPixels(light))
+    assert len(pool.layers) == 2 and pool.memory <= pool.memory_limit
+    # the first light lost its layer but draws it again
+    assert maskPixels(lights[0]) == layers[0]
+    assert lights[2] in pool.layers and lights[1] not in pool.layers
+
+def test_light_map_draws_the_layers_of_the_lights(monkeypatch):
+    monkeypatch.setattr(LightEngine, 'LAYER_POOL', LightEngine.LayerPool(100 * 100 * 4))
+    lights = [makeLight(100 + 40*n, 100 + 10*n, alpha = 150 if n else None,
+                        obstructors = [(90 + 40*n, 120, 30, 10)]) for n in range(3)]
+    light_map = LightEngine.LightMap(300, 250)
+    for light in lights:
+        light.update()
+    light_map.update(enumerate(lights))
+    expected = pygame.Surface((300, 250), pygame.SRCALPHA)
+    expected.fill((0, 0, 0, 0))
+    for light in lights:
+        expected.blit(light.getLayer(), light.light_rect, special_flags = pygame.BLEND_RGBA_MAX)
+    assert pygame.image.tostring(light_map.surface, 'RGBA') == pygame.image.tostring(expected, 'RGBA')
+
+def test_obstructor_grid_queries_like_a_brute_force_search():
+    rng = random.Random(1)
+    grid = LightEngine.ObstructorGrid(cell_size = 64)
+    rects = {}
+    for _ in range(300):
+        rect = pygame.Rect(rng.randint(-200, 1000), rng.randint(-200, 1000),
+                           rng.randint(1, 150), rng.randint(1, 150))
+        rects[grid.insert(rect)] = rect
+    for _ in range(200):
+        handle = rng.choice(list(rects))
+        action = rng.random()
+        if action < 0.3:
+            grid.remove(handle)
+            del rects[handle]
+        elif action < 0.8:
+            rects[handle].move_ip(rng.randint(-100, 100), rng.randint(-100, 100))
+            grid.move(handle, rects[handle])
+        else:
+            rect = pygame.Rect(rng.randint(-200, 1000), rng.randint(-200, 1000), 20, 20)
+            rects[grid.insert(rect)] = rect
+    assert len(grid) == len(rects)
+    for _ in range(100):
+        query = pygame.Rect(rng.randint(-200, 1000), rng.randint(-200, 1000),
+                            rng.randint(1, 400), rng.randint(1, 400))
+        expected = [rects[handle] for handle in sorted(rects) if rects[handle].colliderect(query)]
+        assert grid.query(query) == expected
+
+def test_obstructor_grid_returns_the_given_items():
+    grid = LightEngine.ObstructorGrid(cell_size = 32)
+    grid.insert(pygame.Rect(0, 0, 10, 10), 'a')
+    handle = grid.insert(pygame.Rect(100, 100, 10, 10), 'b')
+    assert grid.query(pygame.Rect(0, 0, 200, 200)) == ['a', 'b']
+    grid.move(handle, pygame.Rect(500, 500, 10, 10))
+    assert grid.query(pygame.Rect(0, 0, 200, 200)) == ['a']
+    assert grid.query(pygame.Rect(495, 495, 10, 10)) == ['b']
+
+@pytest.mark.parametrize('seed', range(10))
+def test_raycast_and_polygons_backends_draw_the_same_masks(seed):
+    rng = random.Random(seed)
+    x, y, size = 200, 200, rng.choice((60, 100, 150))
+    static = []
+    while len(static) < rng.randint(1, 30):
+        rect = pygame.Rect(rng.randint(0, 400), rng.randint(0, 400),
+                           rng.randint(2, 40), rng.randint(2, 40))
+        if not rect.collidepoint(x, y):
+            static.append(rect)
+    auxiliar = pygame.Rect(rng.randint(100, 280), rng.randint(100, 280), 20, 20)
+    masks = []
+    for backend in ('polygons', 'raycast'):
+        light = makeLight(x, y, size, static, backend = backend)
+        if not auxiliar.collidepoint(x, y):
+            light.insertObstructor(auxiliar)
+        light.update()
+        masks.append(light.getBitmask())
+    # only the rasterized edges of the shadows differ, a line of pixels
+    # along each one
+    polygons, raycast = masks
+    differing = polygons.count() + raycast.count() - 2*polygons.overlap_area(raycast, (0, 0))
+    assert differing <= 0.015 * (size*2)**2
+
+def test_raycast_update_sweeps_only_the_auxiliar_obstructors():
+    light = makeLight(obstructors = [(120, 90, 10, 20)], backend = 'raycast')
+    light.insertObstructor(pygame.Rect(70, 90, 10, 20))
+    light.update()
+    static_visibility = light.static_visibility
+    light.clearMaskCache()
+    light.update()
+    assert light.static_visibility is static_visibility
+    # behind the static obstructor, behind the auxiliar one and lit
+    assert not light.isRectInsideLight(pygame.Rect(140, 98, 2, 2), 100, 100)
+    assert not light.isRectInsideLight(pygame.Rect(58, 98, 2, 2), 100, 100)
+    assert light.isRectInsideLight(pygame.Rect(99, 130, 2, 2), 100, 100)
+
+def test_moved_light_draws_like_a_new_one_there(mask_cache):
+    obstructors = [(80, 60, 20, 10), (150, 120, 10, 30), (40, 140, 30, 10)]
+    light = makeLight(100, 100, 60, obstructors)
+    light.update()
+    light.getPolarMap()
+    light.setLightPosition(120, 110)
+    light.update()
+    fresh = makeLight(120, 110, 60, obstructors)
+    fresh.update()
+    assert maskPixels(light) == maskPixels(fresh)
+    assert light.getStaticBitmask().count() == fresh.getStaticBitmask().count()
+    assert light.isPointLit(150, 150) == fresh.isPointLit(150, 150)
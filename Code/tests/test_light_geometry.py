@@ -0,0 +1,185 @@
+# -*- coding: UTF-8 -*-
+import math
+import random
+
+import pytest
+
+pygame = pytest.importorskip('pygame', reason = 'the shadows are drawn with pygame')
+
+import LightGeometry
+
+TILE = 16
+
+def makeTiles(seed, blocks = 12):
+    """
+    Returns a level built like the real ones: blocks of 16px tiles, some of
+    them overlapping.
+    """
+    rng = random.Random(seed)
+    tiles = set()
+    for _ in range(blocks):
+        x0, y0 = rng.randint(0, 30), rng.randint(0, 30)
+        w, h = rng.randint(1, 8), rng.randint(1, 3)
+        if rng.random() < 0.5:
+            w, h = h, w
+        for i in range(w):
+            for j in range(h):
+                tiles.add(((x0 + i)*TILE, (y0 + j)*TILE, TILE, TILE))
+    return sorted(tiles)
+
+def coveredPixels(rects):
+    return set((x, y) for rx, ry, w, h in rects
+               for x in range(rx, rx + w) for y in range(ry, ry + h))
+
+def drawShadows(size, polygons):
+    """
+    Returns the pixels inside the light circle left lit by the polygons, as
+    a pygame.mask.Mask.
+    """
+    surface = pygame.Surface((size*2, size*2))
+    surface.fill((0, 0, 0))
+    pygame.draw.circle(surface, (255, 255, 255), (size, size), size)
+    for polygon in polygons:
+        pygame.draw.polygon(surface, (0, 0, 0), polygon)
+    surface.set_colorkey((0, 0, 0))
+    return pygame.mask.from_surface(surface)
+
+def randomRows(rng, count, side = 600, max_size = 50):
+    """
+    Returns count random rects as flat rows (x, y, width, height, ...), some
+    of them empty.
+    """
+    rows = []
+    for _ in range(count):
+        rows.extend((rng.randint(0, side), rng.randint(0, side),
+                     rng.randint(0, max_size), rng.randint(0, max_size)))
+    return rows
+
+@pytest.mark.parametrize('seed', range(20))
+def test_batch_and_scalar_shadows_match(seed):
+    pytest.importorskip('numpy', reason = 'the batch path needs numpy')
+    rng = random.Random(seed)
+    size = rng.choice((50, 100, 200))
+    x, y = rng.randint(100, 500), rng.randint(100, 500)
+    bounds = (x - size, y - size, x + size, y + size)
+    rows = randomRows(rng, rng.randint(1, 80))
+
+    batch = LightGeometry.getShadowPolygons(size, bounds, rows, batch = True)
+    scalar = LightGeometry.getShadowPolygons(size, bounds, rows, batch = False)
+    assert len(batch) == len(scalar)
+    for polygon, expected in zip(batch, scalar):
+        assert len(polygon) == len(expected)
+        for point, expected_point in zip(polygon, expected):
+            assert point == pytest.approx(expected_point, abs = 1e-9)
+    assert (drawShadows(size, batch).count() == drawShadows(size, scalar).count() ==
+            drawShadows(size, batch).overlap_area(drawShadows(size, scalar), (0, 0)))
+
+@pytest.mark.parametrize('seed', range(5))
+def test_merged_rects_cover_the_same_area(seed):
+    tiles = makeTiles(seed)
+    merged = LightGeometry.mergeRects(tiles)
+    assert len(merged) < len(tiles)
+    assert coveredPixels(merged) == coveredPixels(tiles)
+
+@pytest.mark.parametrize('seed', range(5))
+def test_outline_is_the_same_after_merging(seed):
+    tiles = makeTiles(seed)
+    merged = LightGeometry.mergeRects(tiles)
+    assert (sorted(LightGeometry.getOutlineSegments(tiles)) ==
+            sorted(LightGeometry.getOutlineSegments(merged)))
+
+def test_outline_skips_shared_sides():
+    # two tiles side by side: a 32x16 rect, clockwise
+    segments = LightGeometry.getOutlineSegments([(0, 0, 16, 16), (16, 0, 16, 16)])
+    assert sorted(segments) == sorted([(0, 0, 32, 0), (32, 0, 32, 16),
+                                       (32, 16, 0, 16), (0, 16, 0, 0)])
+
+def randomLight(rng, tiles):
+    """
+    Returns the size and bounds of a light out of the tiles.
+    """
+    size = rng.choice((60, 100, 150))
+    while True:
+        x, y = rng.randint(100, 400), rng.randint(100, 400)
+        if not any(tx <= x < tx + w and ty <= y < ty + h for tx, ty, w, h in tiles):
+            return size, (x - size, y - size, x + size, y + size)
+
+@pytest.mark.parametrize('seed', range(10))
+def test_masks_before_and_after_merging(seed):
+    """
+    The static shadows are cast by the outline, so merging the tiles can't
+    change a pixel.
+    """
+    tiles = makeTiles(seed)
+    size, bounds = randomLight(random.Random(seed), tiles)
+    after = drawShadows(size, LightGeometry.getOutlineShadowPolygons(
+        size, bounds, LightGeometry.getOutlineSegments(LightGeometry.mergeRects(tiles))))
+    before = drawShadows(size, LightGeometry.getOutlineShadowPolygons(
+        size, bounds, LightGeometry.getOutlineSegments(tiles)))
+    assert after.overlap_area(before, (0, 0)) == after.count() == before.count()
+
+@pytest.mark.parametrize('seed', range(40))
+def test_outline_shadows_match_a_polygon_per_rect(seed):
+    """
+    Same pixels as the shadows before outlines, one getPolygon per tile or
+    per merged rect.
+    """
+    tiles = makeTiles(seed)
+    size, bounds = randomLight(random.Random(seed), tiles)
+    outline = drawShadows(size, LightGeometry.getOutlineShadowPolygons(
+        size, bounds, LightGeometry.getOutlineSegments(tiles)))
+    for rects in (tiles, LightGeometry.mergeRects(tiles)):
+        per_rect = drawShadows(size, LightGeometry.getShadowPolygonsScalar(size, bounds, rects))
+        assert outline.overlap_area(per_rect, (0, 0)) == outline.count() == per_rect.count()
+
+def bruteForceDepths(size, segments, bins):
+    """
+    Intersects the ray through the middle of every bin with every segment.
+    """
+    depths = []
+    for n in range(bins):
+        angle = (n + 0.5) * 2*math.pi / bins
+        c, s = math.cos(angle), math.sin(angle)
+        depth = float(size)
+        for x1, y1, x2, y2 in segments:
+            ex, ey = x2 - x1, y2 - y1
+            denom = c*ey - s*ex
+            if denom == 0:
+                continue
+            t = (x1*ey - y1*ex) / denom
+            u = (x1*s - y1*c) / denom
+            if 0 <= u <= 1 and 0 <= t < depth:
+                depth = t
+        depths.append(depth)
+    return depths
+
+def randomSegments(rng, count, size):
+    segments = []
+    for _ in range(count):
+        x, y = rng.uniform(-size, size), rng.uniform(-size, size)
+        segments.append((x, y, x + rng.uniform(-80, 80), y + rng.uniform(-80, 80)))
+    # axis aligned ones, like the outlines
+    for _ in range(count):
+        x, y = rng.randint(-size, size), rng.randint(-size, size)
+        length = rng.randint(1, 60)
+        segments.append((x, y, x + length, y) if rng.random() < 0.5 else (x, y, x, y + length))
+    return segments
+
+@pytest.mark.parametrize('seed', range(10))
+def test_polar_depths_match_a_brute_force_search(seed):
+    rng = random.Random(seed)
+    size, bins = 150, rng.choice((64, 256, 1024))
+    segments = randomSegments(rng, rng.randint(0, 30), size)
+    expected = bruteForceDepths(size, segments, bins)
+    for batch in (False, True):
+        if batch:
+            pytest.importorskip('numpy', reason = 'the batch path needs numpy')
+        depths = LightGeometry.getPolarDepths(size, segments, bins, batch = batch)
+        assert depths == pytest.approx(expected, abs = 1e-9)
+
+def test_polar_bin_is_the_bin_of_the_angle():
+    bins = 360
+    for degrees in range(360):
+        angle = math.radians(degrees + 0.5)
+        dx, dy = math.cos(angle), math.sin(angle)
+        assert LightGeometry.getPolarBin(dx, dy, bins) == degrees
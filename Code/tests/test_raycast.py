@@ -0,0 +1,85 @@
+# -*- coding: UTF-8 -*-
+import random
+
+import pytest
+
+# Globals (imported through helper) sets up pymunk, larv and the window
+pytest.importorskip('pymunk', reason = 'Globals (imported by helper) needs pymunk')
+pytest.importorskip('larv', reason = 'Globals (imported by helper) needs larv')
+pygame = pytest.importorskip('pygame', reason = 'the lights draw with pygame')
+
+import LightGeometry
+from Raycast import Raycast
+
+def sweepRects(rects, x, y, size):
+    """
+    Returns the sweep of a light of the given size at (x, y) over the rects,
+    set up like the raycast backend of Light does it.
+    """
+    raycast = Raycast()
+    raycast.addFacingRectList(rects, x, y)
+    raycast.setBorderWithSize(x, y, size*2)
+    raycast.setLightLocation(x, y)
+    raycast.sweep()
+    return raycast
+
+def crossesRect(x1, y1, x2, y2, rect):
+    """
+    Brute force: whether the segment goes through the inside of the rect.
+    """
+    low, high = 0.0, 1.0
+    for start, delta, minimum, maximum in ((x1, x2 - x1, rect.left, rect.right),
+                                           (y1, y2 - y1, rect.top, rect.bottom)):
+        if delta == 0:
+            if not minimum < start < maximum:
+                return False
+            continue
+        t1 = (minimum - start) / delta
+        t2 = (maximum - start) / delta
+        low = max(low, min(t1, t2))
+        high = min(high, max(t1, t2))
+    return low < high
+
+def randomRects(rng, count, x, y):
+    rects = []
+    while len(rects) < count:
+        rect = pygame.Rect(rng.randint(0, 400), rng.randint(0, 400),
+                           rng.randint(2, 60), rng.randint(2, 60))
+        if not rect.collidepoint(x, y):
+            rects.append(rect)
+    return rects
+
+@pytest.mark.parametrize('seed', range(10))
+def test_sweep_sees_what_a_brute_force_search_sees(seed):
+    rng = random.Random(seed)
+    x, y, size = 200, 200, 150
+    rects = randomRects(rng, rng.randint(1, 25), x, y)
+    raycast = sweepRects(rects, x, y, size)
+    for _ in range(500):
+        px, py = rng.uniform(x - size, x + size), rng.uniform(y - size, y + size)
+        hidden = any(crossesRect(x, y, px, py, rect) for rect in rects)
+        assert raycast.isPointVisible(px, py) == (not hidden)
+
+@pytest.mark.parametrize('seed', range(10))
+def test_sweep_shadows_match_get_polygon(seed):
+    """
+    The shadow of a single rect: the sweep and getPolygon only differ in the
+    rasterized edges.
+    """
+    rng = random.Random(seed)
+    size = 100
+    rect = randomRects(rng, 1, size, size)[0]
+    shadows = []
+    for polygons in (sweepRects([rect], size, size, size).getShadowPolygons(size + 10),
+                     [LightGeometry.getPolygon(size, size, size, *(
+                         rect.left, rect.top, rect.right, rect.bottom))]):
+        surface = pygame.Surface((size*2, size*2))
+        surface.fill((0, 0, 0))
+        pygame.draw.circle(surface, (255, 255, 255), (size, size), size)
+        for polygon in polygons:
+            pygame.draw.polygon(surface, (0, 0, 0), polygon)
+        surface.set_colorkey((0, 0, 0))
+        shadows.append(pygame.mask.from_surface(surface))
+    swept, projected = shadows
+    differing = swept.count() + projected.count() - 2*swept.overlap_area(projected, (0, 0))
+    assert differing <= 0.005 * (size*2)**2